@@ -0,0 +1,117 @@
+# backend/ann.py
+
+import sys
+
+import numpy as np
+
+from recommender import _unit_rows, top_k
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index (cosine similarity).
+    Vectors are clustered with spherical k-means into n_lists buckets; a
+    query scans the n_probe closest buckets and re-ranks their members
+    exactly. Raising n_probe trades latency for recall
+    (n_probe == n_lists is an exact search).
+    """
+
+    def __init__(self, n_lists=256, n_probe=8, n_iter=10, sample_size=50000, seed=42):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+        self.vectors = None
+        self.centroids = None
+        self.list_offsets = None
+        self.list_items = None
+        self.ids = None
+
+    def build(self, vectors, ids=None):
+        vectors = _unit_rows(np.asarray(vectors, dtype=np.float32))
+        n = len(vectors)
+        n_lists = max(1, min(self.n_lists, n))
+        rng = np.random.default_rng(self.seed)
+
+        # k-means is trained on a sample; every vector is assigned afterwards
+        sample = vectors
+        if n > self.sample_size:
+            sample = vectors[rng.choice(n, self.sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(self.n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _unit_rows(sums)
+
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        self.list_items = np.argsort(assign, kind="stable").astype(np.int32)
+        self.list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=self.list_offsets[1:])
+        self.centroids = centroids
+        self.vectors = vectors
+        self.n_lists = n_lists
+        self._set_ids(ids)
+        return self
+
+    def _set_ids(self, ids):
+        self.ids = None if ids is None else np.asarray(ids, dtype=str)
+
+    def search(self, query, k=10, n_probe=None, exclude=None):
+        """Return (rows, scores) of the approximate top-k for a query vector."""
+        query = _unit_rows(np.asarray(query, dtype=np.float32))
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+
+        lists = top_k(self.centroids @ query, n_probe)
+        candidates = np.concatenate(
+            [self.list_items[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists]
+        )
+        if exclude is not None and len(exclude):
+            candidates = candidates[~np.isin(candidates, exclude)]
+
+        scores = self.vectors[candidates] @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def save(self, path):
+        arrays = {
+            "vectors": self.vectors,
+            "centroids": self.centroids,
+            "list_offsets": self.list_offsets,
+            "list_items": self.list_items,
+            "params": np.array([self.n_lists, self.n_probe]),
+        }
+        if self.ids is not None:
+            arrays["ids"] = self.ids
+        np.savez(path, **arrays)
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        n_lists, n_probe = (int(v) for v in data["params"])
+        index = IVFIndex(n_lists=n_lists, n_probe=n_probe)
+        index.vectors = data["vectors"]
+        index.centroids = data["centroids"]
+        index.list_offsets = data["list_offsets"]
+        index.list_items = data["list_items"]
+        index._set_ids(data["ids"] if "ids" in data else None)
+        return index
+
+
+if __name__ == "__main__":
+    # Offline step: python ann.py models/recommender models/cf_ann.npz [n_lists] [n_probe]
+    from recommender import Recommender
+
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "models/recommender"
+    index_path = sys.argv[2] if len(sys.argv) > 2 else "models/cf_ann.npz"
+    n_lists = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+    n_probe = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+
+    rec = Recommender.load(model_path)
+    print(f"⚙️ Building IVF index ({n_lists} lists, probe {n_probe}) over CF item factors...")
+    index = rec.build_cf_index(n_lists=n_lists, n_probe=n_probe)
+    index.save(index_path)
+    print(f"✅ ANN index saved at {index_path}")
@@ -3,11 +3,31 @@
 # backend/app.py
 from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from starlette.background import BackgroundTask
 from typing import Optional
+import numpy as np
 import pandas as pd
-import pickle
+import gc
+import json
+import logging
 import os
+import threading
+import time
+
+from ann import IVFIndex
+import artifacts
+from catalog_store import read_table
+from recommender import Recommender
+from search_index import BookSearchIndex
+from serving import BoundedExecutor, JsonFormatter, LatencyBudget, Overloaded, RequestLog
+from cache import ResultCache, UserProfileCache
+from pipeline import MMR, RecommendationPipeline, diversify, edition_keys
+from popularity import GLOBAL_SEGMENT, segments_for
+from sharding import ShardedRecommender
+import metrics
+import model_store
 
 app = FastAPI()
 
@@ -20,68 +40,346 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Structured JSON logs on stderr; per-request lines are sampled
+logger = logging.getLogger("recommender.api")
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(JsonFormatter())
+logger.addHandler(_log_handler)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+logger.propagate = False
+request_log = RequestLog(
+    logger,
+    sample_rate=float(os.environ.get("LOG_SAMPLE_RATE", "0.01")),
+    slow_ms=float(os.environ.get("LOG_SLOW_MS", "250")),
+)
+
+# Prometheus /metrics: request and stage latency histograms are observed
+# inline; cache, executor and model gauges are read at scrape time
+registry = metrics.Registry()
+request_seconds = registry.histogram(
+    "recommender_request_seconds", "End-to-end latency of API requests", ("endpoint", "cached"))
+stage_seconds = registry.histogram(
+    "recommender_stage_seconds",
+    "Latency of /recommend stages: executor queue wait, pipeline stages "
+    "(sources, filter, profile, rank/full_scan, diversity top-k), shards, popularity, serialize",
+    ("stage",))
+
 # Paths
 DATA_PATH = "./data/Books.csv"
-PICKLE_PATH = "./models/cf_matrix.pkl"
+MODEL_ROOT = "./models"
+# Legacy flat layout, used while no version has been published (model_store.py)
+MODEL_PATH = "./models/recommender"
+ANN_PATH = "./models/cf_ann.npz"
+
+# Seconds between checks of models/CURRENT for a newly published version (0 = off)
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", "10"))
+
+# Trigram index answers substring queries the token index misses (costs startup time)
+SEARCH_TRIGRAMS = os.environ.get("SEARCH_TRIGRAMS", "0") == "1"
+
+# Scoring deadline in ms; requests predicted to overrun it get popularity (0 = off)
+DEADLINE_MS = float(os.environ.get("RECOMMEND_DEADLINE_MS", "0"))
+
+# Diversity step: "mmr" (MMR re-ranking with edition dedup) or "threshold"
+# (pipeline.diversify: cheaper near-duplicate filter)
+DIVERSITY = os.environ.get("RECOMMEND_DIVERSITY", "mmr")
+
+# Directory written by sharding.py; when set, personalised scoring is
+# scattered over one worker process per item shard (not hot-reloaded)
+SHARDS_DIR = os.environ.get("RECOMMEND_SHARDS_DIR", "")
+
+# CPU-bound request work runs here; past the queue limit requests get 503
+executor = BoundedExecutor(
+    max_workers=int(os.environ.get("RECOMMEND_WORKERS", "0")) or None,
+    max_pending=int(os.environ.get("RECOMMEND_QUEUE_LIMIT", "0")) or None,
+)
 
 # Load dataset
 try:
-    books_df = pd.read_csv(DATA_PATH, low_memory=False)
-    print(f"✅ Loaded {len(books_df)} books")
+    # Memory-mapped columnar store when converted (catalog_store.py), else the CSV
+    books_df = read_table(DATA_PATH)
+    logger.info("books_loaded", extra={"fields": {"books": len(books_df)}})
 
     # Normalize columns: rename ISBN → book_id
     if "ISBN" in books_df.columns:
         books_df = books_df.rename(columns={"ISBN": "book_id"})
+
+    # Inverted index for /books; results are served from plain arrays
+    book_ids = books_df["book_id"].to_numpy(dtype=object)
+    search_index = BookSearchIndex(
+        books_df["Book-Title"].astype(object).fillna("").to_numpy(),
+        books_df["Book-Author"].astype(object).fillna("").to_numpy(),
+        trigrams=SEARCH_TRIGRAMS,
+    )
+    # book_id -> row for response payloads; first row wins on duplicate ids
+    book_rows = {}
+    for row, book_id in enumerate(book_ids.tolist()):
+        book_rows.setdefault(book_id, row)
+    logger.info("search_index_built", extra={"fields": {"tokens": len(search_index.vocab)}})
 except FileNotFoundError:
-    print(f"⚠️ Books dataset not found at {DATA_PATH}")
+    logger.warning("books_not_found", extra={"fields": {"path": DATA_PATH}})
     books_df = pd.DataFrame()
+    book_rows = {}
+    search_index = None
+
+# In-process /recommend result cache; cleared whenever the model is (re)loaded
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", "300")),
+)
+
+# Known users' liked-side scoring profiles; rebuilt per model automatically
+profile_cache = UserProfileCache(
+    max_entries=int(os.environ.get("PROFILE_CACHE_SIZE", "10000")),
+    spill_dir=os.environ.get("PROFILE_SPILL_DIR") or None,
+)
 
-# Load model
-cf_matrix = {}
-if os.path.exists(PICKLE_PATH):
+
+def model_paths(version):
+    """(recommender, ANN index) paths of a published version, or the legacy flat layout."""
+    if version is None:
+        return MODEL_PATH, ANN_PATH
+    path = model_store.version_dir(MODEL_ROOT, version)
+    return os.path.join(path, "recommender"), os.path.join(path, "cf_ann.npz")
+
+
+def load_model(version=None):
+    """Load the trained recommender (+ ANN index) and warm it up."""
+    model_path, ann_path = model_paths(version)
+    if not artifacts.exists(model_path):
+        logger.warning("model_not_found", extra={"fields": {"path": model_path}})
+        return None
     try:
-        with open(PICKLE_PATH, "rb") as f:
-            cf_matrix = pickle.load(f)
-        print("✅ Model loaded")
-    except Exception as e:
-        print("⚠️ Error loading pickle:", e)
+        model = Recommender.load(model_path)
+        logger.info("model_loaded", extra={"fields": {"version": version, "path": model_path}})
+    except Exception:
+        logger.exception("model_load_failed", extra={"fields": {"version": version, "path": model_path}})
+        return None
+
+    # Bundles from train.py carry their ANN index; else a standalone one from ann.py
+    if model.cf_index is None and os.path.exists(ann_path):
+        try:
+            model.cf_index = IVFIndex.load(ann_path)
+            logger.info("ann_index_loaded", extra={"fields": {"items": len(model.cf_index.vectors)}})
+        except Exception:
+            logger.exception("ann_index_load_failed", extra={"fields": {"path": ann_path}})
+
+    # Warm up so the first real request doesn't pay for lazy initialisation
+    if model.item_ids:
+        model.recommend(model.item_ids[:1], k=1)
+    return model
+
+
+# Serialises reloads so two versions are never being loaded at the same time
+_reload_lock = threading.Lock()
+
+
+def reload_model(version=None):
+    """
+    Load `version` (default: the published CURRENT) and swap it in.
+    Loading and warm-up happen before the swap, so requests keep being
+    served by the old model meanwhile; in-flight requests hold their own
+    reference and finish on the model they started with. A version that
+    fails to load leaves the serving model in place.
+    """
+    global recommender, model_version, failed_version
+    if sharded is not None:
+        # Shard mode never holds the full model in the API process
+        return False
+    with _reload_lock:
+        if version is None:
+            version = model_store.current_version(MODEL_ROOT)
+        model = load_model(version)
+        if model is None:
+            # Whatever serves (possibly nothing) keeps serving; the poller
+            # skips this version until a newer one is published
+            failed_version = version
+            return False
+        recommender, model_version, failed_version = model, version, None
+        # After the swap, so nothing computed by the old model survives the clear
+        result_cache.clear()
+        profile_cache.clear()
+        del model
+    # The old model is garbage once in-flight requests release it; collect
+    # now rather than holding two models until the next automatic cycle
+    gc.collect()
+    return True
+
+
+def _watch_models():
+    """Background poller: load and swap in a newly published version."""
+    while True:
+        time.sleep(MODEL_POLL_SECONDS)
+        try:
+            version = model_store.current_version(MODEL_ROOT)
+            if version not in (model_version, failed_version):
+                reload_model(version)
+        except Exception:
+            logger.exception("model_reload_failed")
+
+
+# Load trained recommender once; requests only touch its precomputed arrays.
+# In shard mode only the shard processes hold item data: no full model, no poller
+recommender = None
+model_version = None
+failed_version = None
+sharded = None
+if SHARDS_DIR:
+    sharded = ShardedRecommender(SHARDS_DIR)
+    logger.info("shards_loaded", extra={"fields": {"path": SHARDS_DIR, "shards": len(sharded.shards)}})
 else:
-    print("⚠️ Model not found, using dummy fallback.")
+    reload_model()
+    if MODEL_POLL_SECONDS > 0:
+        threading.Thread(target=_watch_models, name="model-watcher", daemon=True).start()
+budget = LatencyBudget(deadline_ms=DEADLINE_MS)
+# Candidate generation + re-ranking; holds no model state, so it survives reloads.
+if DIVERSITY == "threshold":
+    diversity = diversify
+elif DIVERSITY == "mmr":
+    # MMR drops other editions of a candidate by catalog title/author first
+    diversity = MMR(keys=edition_keys(book_ids, search_index.titles, search_index.authors)
+                    if search_index is not None else None)
+else:
+    raise ValueError(f"RECOMMEND_DIVERSITY must be 'mmr' or 'threshold', not {DIVERSITY!r}")
+pipeline = RecommendationPipeline(diversity=diversity, profiles=profile_cache)
 
 
 class RecommendationRequest(BaseModel):
     user_id: Optional[int] = None
     liked_book_ids: list[str] = []
-    k: int = 10
+    # Already-read books to keep out of the results (liked books always are)
+    exclude_book_ids: list[str] = []
+    # Optional Users.csv-style profile; picks the segment popularity ranking
+    # (known user_ids default to the segments stored at training time)
+    age: Optional[int] = None
+    location: Optional[str] = None
+    # Same bound as /books' limit: k sizes the scoring work and cache entries
+    k: int = Field(10, ge=1, le=100)
 
 
-@app.get("/books")
-def list_books(q: str = Query("", min_length=0)):
-    """Simple search in Books.csv"""
-    if books_df.empty:
-        return []
+class BatchRecommendationItem(BaseModel):
+    # Only what recommend_batch scores on; k is per batch. Unknown fields
+    # (per-item k, excludes, profile) are rejected rather than dropped
+    model_config = ConfigDict(extra="forbid")
+
+    user_id: Optional[int] = None
+    liked_book_ids: list[str] = []
+
+
+class BatchRecommendationRequest(BaseModel):
+    requests: list[BatchRecommendationItem]
+    k: int = Field(10, ge=1, le=100)
+
+
+def book_payload(book_id):
+    row = book_rows.get(book_id)
+    if row is not None:
+        return {
+            "book_id": book_id,
+            "title": search_index.titles[row] or "Unknown",
+            "author": search_index.authors[row] or "Unknown",
+        }
+    return {"book_id": book_id, "title": "Unknown", "author": "Unknown"}
 
-    results = books_df[
-        books_df["Book-Title"].str.contains(q, case=False, na=False)
-        | books_df["Book-Author"].str.contains(q, case=False, na=False)
-    ].head(20)
 
+@app.exception_handler(Overloaded)
+async def overloaded(request, exc):
+    return JSONResponse({"detail": "Server busy, retry shortly"}, status_code=503,
+                        headers={"Retry-After": "1"})
+
+
+def search_books(q, limit, offset):
+    rows = search_index.search(q, limit=limit, offset=offset)
     # Return consistent schema
     return [
         {
-            "book_id": row.get("book_id", "unknown"),
-            "title": row.get("Book-Title", "Unknown"),
-            "author": row.get("Book-Author", "Unknown"),
+            "book_id": book_ids[row],
+            "title": search_index.titles[row],
+            "author": search_index.authors[row],
         }
-        for _, row in results.iterrows()
+        for row in rows.tolist()
     ]
 
 
-@app.post("/recommend")
-def recommend(req: RecommendationRequest):
-    """Dummy recommender – returns random top-k books."""
-    print(f"📩 Request: {req.dict()}")
+@app.get("/books")
+async def list_books(
+    q: str = Query("", min_length=0),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """Ranked title/author search over Books.csv"""
+    if search_index is None:
+        return []
+    start = time.perf_counter()
+    books = await executor.run(search_books, q, limit, offset)
+    elapsed = time.perf_counter() - start
+    request_seconds.observe(("books", "false"), elapsed)
+    request_log.log("books", elapsed * 1000, q=q, results=len(books))
+    return books
+
+
+def random_books(k):
+    rows = np.random.default_rng().choice(len(book_ids), size=min(k, len(book_ids)), replace=False)
+    return [book_payload(book_ids[row]) for row in rows.tolist()]
+
+
+def score_request(model, req, segments, submitted=None):
+    """(recommendations, cacheable) for one request; runs on the executor."""
+    start = time.perf_counter()
+    if submitted is not None:
+        stage_seconds.observe(("queue",), start - submitted)
+    # The shard coordinator stands in for the in-process model when configured
+    model = sharded or model
+    if model is None:
+        # No model: top-k random books
+        return random_books(req.k), False
+
+    recs = []
+    degraded = False
+    n_liked = len(req.liked_book_ids)
+    if n_liked and budget.allows(n_liked):
+        start = time.perf_counter()
+        if model is sharded:
+            # Scatter-gather: every shard scores its slice, top lists are merged
+            # and re-ranked with the pipeline's diversity step
+            recs = model.recommend(req.liked_book_ids, k=req.k, user_id=req.user_id,
+                                   exclude_book_ids=req.exclude_book_ids, diversity=pipeline.diversity)
+            stage_seconds.observe(("shards",), time.perf_counter() - start)
+        else:
+            recs, timings = pipeline.recommend(model, req.liked_book_ids, k=req.k,
+                                               exclude_book_ids=req.exclude_book_ids, user_id=req.user_id)
+            for stage, ms in timings.items():
+                stage_seconds.observe((stage,), ms / 1000)
+        budget.record(n_liked, (time.perf_counter() - start) * 1000)
+    elif n_liked:
+        degraded = True
+    if not recs:
+        start = time.perf_counter()
+        recs = model.recommend(req.liked_book_ids, k=req.k, use_popularity=True, segments=segments,
+                               user_id=req.user_id, exclude_book_ids=req.exclude_book_ids)
+        stage_seconds.observe(("popularity",), time.perf_counter() - start)
+    if not recs:
+        # No popularity ranking either
+        return random_books(req.k), False
+    start = time.perf_counter()
+    payload = [book_payload(r["book_id"]) for r in recs]
+    stage_seconds.observe(("serialize",), time.perf_counter() - start)
+    # Popularity served only because of the latency budget isn't the real answer
+    return payload, not degraded
 
+
+def request_segments(model, req):
+    """Popularity segments from the request's profile, else those stored for a known user_id."""
+    if req.age is not None or req.location is not None or model is None:
+        return segments_for(req.age, req.location)
+    # Legacy pickled models predate the per-user segments
+    known = getattr(model, "user_segments", {}).get(req.user_id, ())
+    return list(known) + [GLOBAL_SEGMENT]
+
+
+@app.post("/recommend")
+async def recommend(req: RecommendationRequest):
+    """Hybrid CF + content recommendations, popularity for cold start or overload."""
     if books_df.empty:
         return {"recommendations": [
             {"book_id": "dummy1", "title": "The Pragmatic Programmer", "author": "Andrew Hunt"},
@@ -89,16 +387,135 @@ def recommend(req: RecommendationRequest):
             {"book_id": "dummy3", "title": "Deep Learning", "author": "Ian Goodfellow"},
         ]}
 
-    # Just return top-k random books
-    sample_books = books_df.sample(min(req.k, len(books_df)))
-    recommendations = [
-        {
-            "book_id": row.get("book_id", row.get("ISBN", "unknown")),
-            "title": row.get("Book-Title", "Unknown"),
-            "author": row.get("Book-Author", "Unknown"),
-        }
-        for _, row in sample_books.iterrows()
-    ]
+    start = time.perf_counter()
+    # Generation first: reload swaps the model before clearing the cache, so a
+    # reload between these two reads can only make the put below a no-op
+    generation = result_cache.generation
+    # One reference per request: a concurrent reload can't switch models mid-way
+    model = recommender
+    segments = request_segments(sharded or model, req)
+    key = result_cache.key(req.liked_book_ids, req.k, req.exclude_book_ids, segments, req.user_id)
+    # Cache hits are answered on the event loop without taking an executor slot
+    recommendations = result_cache.get(key) if (sharded or model) is not None else None
+    cached = recommendations is not None
+    if not cached:
+        recommendations, cacheable = await executor.run(
+            score_request, model, req, segments, time.perf_counter())
+        if cacheable:
+            result_cache.put(key, recommendations, generation)
 
+    elapsed = time.perf_counter() - start
+    request_seconds.observe(("recommend", "true" if cached else "false"), elapsed)
+    request_log.log("recommend", elapsed * 1000, user_id=req.user_id,
+                    n_liked=len(req.liked_book_ids), k=req.k, cached=cached,
+                    model_version=model_version)
     return {"recommendations": recommendations}
 
+
+@app.get("/cache")
+def cache_stats():
+    """Hit/miss counters of the /recommend result cache."""
+    return result_cache.stats()
+
+
+@app.get("/profiles")
+def profile_cache_stats():
+    """Hit/update/miss counters of the user profile cache."""
+    return profile_cache.stats()
+
+
+@app.get("/pipeline")
+def pipeline_stats():
+    """Smoothed per-stage latency (ms) of the recommendation pipeline."""
+    return pipeline.stats()
+
+
+@app.get("/executor")
+def executor_stats():
+    """Queue depth and rejections of the scoring executor."""
+    return executor.stats()
+
+
+@registry.collector
+def _serving_metrics():
+    lines = []
+    for prefix, stats in (("recommender_result_cache", result_cache.stats()),
+                          ("recommender_profile_cache", profile_cache.stats())):
+        lines += metrics.family(f"{prefix}_entries", "gauge", "Entries held", [({}, stats["entries"])])
+        lines += metrics.family(f"{prefix}_hit_ratio", "gauge", "Hits / lookups since start",
+                                [({}, stats["hit_ratio"])])
+        for counter, help in (("hits", "Lookups answered from the cache"),
+                              ("misses", "Lookups that had to be computed"),
+                              ("evictions", "Entries dropped by LRU eviction")):
+            lines += metrics.family(f"{prefix}_{counter}_total", "counter", help, [({}, stats[counter])])
+    lines += metrics.family("recommender_profile_cache_updates_total", "counter",
+                            "Lookups served by updating an entry with added/removed books",
+                            [({}, profile_cache.updates)])
+
+    stats = executor.stats()
+    lines += metrics.family("recommender_executor_pending", "gauge", "Queued + running scoring jobs",
+                            [({}, stats["pending"])])
+    lines += metrics.family("recommender_executor_max_pending", "gauge", "Queue-depth limit before 503s",
+                            [({}, stats["max_pending"])])
+    lines += metrics.family("recommender_executor_rejected_total", "counter", "Requests answered 503",
+                            [({}, stats["rejected"])])
+
+    lines += metrics.family("recommender_model_info", "gauge", "Serving model version (value is always 1)",
+                            [({"version": model_version or ""}, 1)])
+    lines += metrics.family("recommender_model_loaded", "gauge", "1 if a trained model is serving",
+                            [({}, int(recommender is not None))])
+    lines += metrics.family("recommender_model_reload_failed", "gauge",
+                            "1 while a published version failed to load",
+                            [({"version": failed_version or ""}, int(failed_version is not None))])
+    lines += metrics.family("recommender_shards", "gauge", "Item shards serving /recommend",
+                            [({}, len(sharded.shards) if sharded is not None else 0)])
+    return lines
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition of latency histograms, cache, executor and model gauges."""
+    return PlainTextResponse(registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/model")
+def model_info():
+    """Version of the model currently serving requests."""
+    return {"version": model_version, "loaded": recommender is not None,
+            "shards": len(sharded.shards) if sharded is not None else 0}
+
+
+@app.post("/model/reload")
+def model_reload():
+    """Load the published CURRENT version now instead of waiting for the poller."""
+    swapped = reload_model()
+    return {"version": model_version, "swapped": swapped}
+
+
+@app.post("/recommend/batch")
+def recommend_batch(req: BatchRecommendationRequest):
+    """Score many requests in one blocked pass; results stream back as NDJSON."""
+    model = recommender
+    if model is None:
+        return StreamingResponse(iter(()), media_type="application/x-ndjson")
+
+    queries = ((r.user_id, r.liked_book_ids) for r in req.requests)
+    # A whole batch holds one executor slot while it streams. Released by the
+    # generator, or by the background task if streaming never started
+    executor.reserve()
+    released = threading.Event()
+
+    def release():
+        if not released.is_set():
+            released.set()
+            executor.release()
+
+    def lines():
+        try:
+            for (user_id, _), recs in model.recommend_batch(queries, k=req.k):
+                recs = [book_payload(r["book_id"]) for r in recs]
+                yield json.dumps({"user_id": user_id, "recommendations": recs}) + "\n"
+        finally:
+            release()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(release))
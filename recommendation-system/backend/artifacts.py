@@ -0,0 +1,230 @@
+# backend/artifacts.py
+
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from popularity import decode_user_segments, encode_user_segments
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+
+def exists(path):
+    """A model is saved at `path`: array bundle directory or legacy `{path}.pkl`."""
+    return os.path.exists(os.path.join(path, MANIFEST)) or os.path.exists(f"{path}.pkl")
+
+
+def _plain(ids):
+    # np.save can't store object arrays without pickle; ids become str/int arrays
+    arr = np.asarray(ids)
+    return arr.astype(str) if arr.dtype == object else arr
+
+
+def _vectorizer_meta(vectorizer, arrays):
+    if vectorizer is None:
+        return None
+    if isinstance(vectorizer, TfidfVectorizer):
+        terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+        arrays["tfidf_terms"] = np.asarray(terms, dtype=str)
+        arrays["tfidf_idf"] = vectorizer.idf_.astype(np.float32)
+        return {"kind": "tfidf", "stop_words": vectorizer.stop_words}
+    # content_index.make_vectorizer: stateless, only its width matters
+    return {"kind": "hashing", "n_features": vectorizer.n_features}
+
+
+def _load_vectorizer(meta, arrays):
+    if meta is None:
+        return None
+    if meta["kind"] == "hashing":
+        from content_index import make_vectorizer
+
+        return make_vectorizer(meta["n_features"])
+    vectorizer = TfidfVectorizer(stop_words=meta["stop_words"],
+                                 vocabulary=arrays["tfidf_terms"].tolist())
+    vectorizer.idf_ = np.asarray(arrays["tfidf_idf"])
+    return vectorizer
+
+
+def save_bundle(rec, path):
+    """
+    Write a Recommender as a directory of .npy arrays plus a JSON manifest.
+    Everything the server touches per request is a plain array, so
+    load_bundle can memory-map it and every worker process shares one
+    copy through the page cache. The bundle is written to a temp sibling
+    directory and renamed over `path` when complete, so saving a model
+    that is memory-mapped from `path` itself never truncates its arrays,
+    and a failed save leaves the old bundle intact.
+    """
+    from recommender import ImplicitALS
+
+    path = os.path.normpath(path)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    arrays = {}
+    manifest = {
+        "format": FORMAT_VERSION,
+        "params": {
+            "cf_components": rec.cf_components,
+            "hybrid_alpha": rec.hybrid_alpha,
+            "cf_engine": rec.cf_engine,
+            "als_params": rec.als_params,
+        },
+    }
+
+    if rec.item_ids is not None:
+        arrays["item_ids"] = _plain(rec.item_ids)
+
+    if rec.cf_model is not None:
+        arrays["cf_components"] = rec.cf_model.components_
+        arrays["cf_matrix"] = rec.cf_matrix
+        arrays["cf_item_vectors"] = rec.cf_item_vectors
+        arrays["user_ids"] = _plain(list(rec.user_index))
+        if rec.seen_indptr is not None:
+            arrays["seen_indptr"] = rec.seen_indptr
+            arrays["seen_items"] = rec.seen_items
+        als = isinstance(rec.cf_model, ImplicitALS)
+        if not als:
+            arrays["cf_singular_values"] = rec.cf_model.singular_values_
+        manifest["cf"] = {
+            "model": "als" if als else "svd",
+            "fit_nnz": int(getattr(rec, "cf_fit_nnz", 0)),
+            "model_params": {
+                name: getattr(rec.cf_model, name)
+                for name in ("factors", "regularization", "alpha", "iterations", "cg_steps", "block_size")
+            } if als else {},
+        }
+
+    if rec.content_matrix is not None:
+        matrix = rec.content_matrix
+        # One index dtype for indptr and indices lets scipy keep the memmaps as is
+        index_dtype = np.int64 if matrix.indptr.dtype == np.int64 else np.int32
+        arrays["content_data"] = matrix.data
+        arrays["content_indices"] = matrix.indices.astype(index_dtype, copy=False)
+        arrays["content_indptr"] = matrix.indptr.astype(index_dtype, copy=False)
+        manifest["content"] = {
+            "shape": list(matrix.shape),
+            "vectorizer": _vectorizer_meta(rec.tfidf, arrays),
+        }
+
+    if rec.neighbor_idx is not None:
+        arrays["neighbor_idx"] = rec.neighbor_idx
+        arrays["neighbor_scores"] = rec.neighbor_scores
+
+    if rec.popularity:
+        segments = list(rec.popularity)
+        lengths = [len(rec.popularity[s][0]) for s in segments]
+        arrays["popularity_rows"] = np.concatenate([rec.popularity[s][0] for s in segments])
+        arrays["popularity_scores"] = np.concatenate([rec.popularity[s][1] for s in segments])
+        manifest["popularity"] = {"segments": segments,
+                                  "offsets": np.concatenate([[0], np.cumsum(lengths)]).tolist()}
+        if rec.user_segments:
+            user_ids, codes = encode_user_segments(rec.user_segments, segments)
+            arrays["segment_user_ids"] = _plain(user_ids)
+            arrays["segment_codes"] = codes
+
+    if rec.cf_index is not None:
+        index = rec.cf_index
+        arrays.update(ann_vectors=index.vectors, ann_centroids=index.centroids,
+                      ann_list_offsets=index.list_offsets, ann_list_items=index.list_items)
+        # The index is normally built over the catalog rows; share their ids then
+        shared = index.ids is not None and rec.item_ids is not None and \
+            np.array_equal(index.ids, np.asarray(rec.item_ids, dtype=str))
+        if index.ids is not None and not shared:
+            arrays["ann_ids"] = index.ids
+        manifest["ann"] = {"n_lists": index.n_lists, "n_probe": index.n_probe, "shared_ids": shared}
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+    manifest["arrays"] = sorted(arrays)
+    with open(os.path.join(tmp_path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Directories can't be os.replace'd over a non-empty one: move the old
+    # bundle aside first. Open memmaps keep their (unlinked) files alive.
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def load_bundle(path, mmap=True):
+    """Recommender from a bundle; arrays are memory-mapped read-only unless mmap=False."""
+    from ann import IVFIndex
+    from recommender import ImplicitALS, Recommender
+
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    mode = "r" if mmap else None
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+              for name in manifest["arrays"]}
+
+    rec = Recommender(**manifest["params"])
+    if "item_ids" in arrays:
+        rec.item_ids = arrays["item_ids"].tolist()
+        rec.item_index = {book_id: i for i, book_id in enumerate(rec.item_ids)}
+
+    cf = manifest.get("cf")
+    if cf is not None:
+        components = arrays["cf_components"]
+        if cf["model"] == "als":
+            model = ImplicitALS(**cf["model_params"])
+        else:
+            model = TruncatedSVD(n_components=components.shape[0], random_state=42)
+            model.singular_values_ = arrays["cf_singular_values"]
+            model.n_features_in_ = components.shape[1]
+        model.components_ = components
+        rec.cf_model = model
+        rec.cf_matrix = arrays["cf_matrix"]
+        rec.cf_item_vectors = arrays["cf_item_vectors"]
+        rec.cf_fit_nnz = cf["fit_nnz"]
+        rec.user_index = {u: i for i, u in enumerate(arrays["user_ids"].tolist())}
+        rec.seen_indptr = arrays.get("seen_indptr")
+        rec.seen_items = arrays.get("seen_items")
+
+    content = manifest.get("content")
+    if content is not None:
+        rec.content_matrix = csr_matrix(
+            (arrays["content_data"], arrays["content_indices"], arrays["content_indptr"]),
+            shape=tuple(content["shape"]), copy=False,
+        )
+        rec.tfidf = _load_vectorizer(content["vectorizer"], arrays)
+
+    if "neighbor_idx" in arrays:
+        rec.neighbor_idx = arrays["neighbor_idx"]
+        rec.neighbor_scores = arrays["neighbor_scores"]
+
+    popularity = manifest.get("popularity")
+    if popularity is not None:
+        offsets = popularity["offsets"]
+        rec.popularity = {
+            segment: (arrays["popularity_rows"][offsets[i]:offsets[i + 1]],
+                      arrays["popularity_scores"][offsets[i]:offsets[i + 1]])
+            for i, segment in enumerate(popularity["segments"])
+        }
+        if "segment_user_ids" in arrays:
+            rec.user_segments = decode_user_segments(arrays["segment_user_ids"], arrays["segment_codes"],
+                                                     popularity["segments"])
+
+    ann = manifest.get("ann")
+    if ann is not None:
+        index = IVFIndex(n_lists=ann["n_lists"], n_probe=ann["n_probe"])
+        index.vectors = arrays["ann_vectors"]
+        index.centroids = arrays["ann_centroids"]
+        index.list_offsets = arrays["ann_list_offsets"]
+        index.list_items = arrays["ann_list_items"]
+        if ann["shared_ids"]:
+            index.ids = arrays["item_ids"]
+        else:
+            index._set_ids(arrays.get("ann_ids"))
+        rec.cf_index = index
+    return rec
@@ -0,0 +1,46 @@
+# backend/batch_recommend.py
+
+import argparse
+import json
+import sys
+import time
+
+from recommender import Recommender
+
+
+def read_queries(lines):
+    """JSONL requests ({"user_id": ..., "liked_book_ids": [...]}) -> (user_id, liked) pairs"""
+    for line in lines:
+        if line.strip():
+            req = json.loads(line)
+            yield req.get("user_id"), req.get("liked_book_ids") or []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline batch recommendations as NDJSON")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL requests, - for stdin")
+    parser.add_argument("--output", default="-", help="NDJSON output, - for stdout")
+    parser.add_argument("--model", default="models/recommender")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--block-size", type=int, default=None, help="default: sized by --memory-mb")
+    parser.add_argument("--memory-mb", type=int, default=1024, help="budget for the score blocks in flight")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    rec = Recommender.load(args.model)
+    src = sys.stdin if args.input == "-" else open(args.input)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    start = time.perf_counter()
+    n = 0
+    results = rec.recommend_batch(
+        read_queries(src), k=args.k, block_size=args.block_size, n_threads=args.threads,
+        memory_mb=args.memory_mb,
+    )
+    for (user_id, _), recs in results:
+        out.write(json.dumps({"user_id": user_id, "recommendations": recs}) + "\n")
+        n += 1
+    out.flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {n} requests in {elapsed:.2f}s ({n / max(elapsed, 1e-9):.0f} req/s)", file=sys.stderr)
@@ -0,0 +1,204 @@
+# backend/benchmark.py
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from data_processing import build_content_index, build_user_item_matrix
+from pipeline import RecommendationPipeline
+from recommender import Recommender
+
+WORDS = np.array(
+    "love war night house dark secret life death world city river garden king queen "
+    "murder summer winter girl boy stars moon fire ocean shadow heart story island "
+    "journey empire ghost stone silver golden lost last first little great blood".split()
+)
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000"""
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1].lower(), 1)
+    return int(float(text.rstrip("kKmM")) * scale)
+
+
+def synthetic_data(n_items, seed=42):
+    """
+    Book-Crossing-shaped tables: about as many users as books, ~4 ratings
+    per book with Zipf-distributed book popularity, ~62% implicit 0
+    ratings, and short title/author/publisher strings.
+    """
+    rng = np.random.default_rng(seed)
+    n_users = n_items
+    n_ratings = 4 * n_items
+    book_ids = np.char.add("b", np.arange(n_items).astype(str)).astype(object)
+
+    titles = pd.Series(WORDS[rng.integers(0, len(WORDS), n_items)]).str.cat(
+        [pd.Series(WORDS[rng.integers(0, len(WORDS), n_items)]) for _ in range(2)], sep=" ")
+    books = pd.DataFrame({
+        "book_id": book_ids,
+        "book-title": titles,
+        "book-author": "Author " + pd.Series(rng.integers(0, max(n_items // 5, 1), n_items)).astype(str),
+        "publisher": "Publisher " + pd.Series(rng.integers(0, max(n_items // 100, 1), n_items)).astype(str),
+    })
+
+    item_rows = (rng.zipf(1.3, n_ratings) - 1) % n_items
+    ratings = pd.DataFrame({
+        "user_id": rng.integers(0, n_users, n_ratings),
+        "book_id": book_ids[rng.permutation(n_items)[item_rows]],
+        "book-rating": np.where(rng.random(n_ratings) < 0.62, 0, rng.integers(1, 11, n_ratings)),
+    })
+    users = pd.DataFrame({
+        "user_id": np.arange(n_users),
+        "location": rng.choice(["london, england, united kingdom", "new york, new york, usa",
+                                "toronto, ontario, canada", "berlin, berlin, germany"], n_users),
+        "age": np.where(rng.random(n_users) < 0.4, np.nan, rng.integers(10, 80, n_users)),
+    })
+    return ratings, books, users
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p90_ms": round(float(np.percentile(samples, 90)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "max_ms": round(float(samples.max()), 3),
+    }
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, round(time.perf_counter() - start, 3)
+
+
+def run_size(n_items, n_requests=500, batch_size=5000, neighbours=False, seed=42):
+    """All measurements for one catalog size; run in a fresh process for a clean peak RSS."""
+    rng = np.random.default_rng(seed)
+    ratings, books, users = synthetic_data(n_items, seed)
+    result = {"n_items": n_items, "n_ratings": len(ratings), "fit_s": {}}
+    fit = result["fit_s"]
+
+    (matrix, meta), fit["user_item_matrix"] = _timed(
+        build_user_item_matrix, ratings, item_ids=books["book_id"].to_numpy())
+    rec = Recommender()
+    _, fit["fit_cf"] = _timed(rec.fit_cf, matrix, user_ids=meta["user_ids"])
+    (content, tfidf), fit["content_index"] = _timed(build_content_index, books)
+    _, fit["fit_content"] = _timed(rec.fit_content, content, books["book_id"], tfidf)
+    if neighbours:
+        _, fit["fit_neighbors"] = _timed(rec.fit_neighbors)
+    _, fit["build_popularity"] = _timed(rec.build_popularity, ratings, users)
+    _, fit["build_cf_index"] = _timed(rec.build_cf_index, n_lists=min(256, max(n_items // 100, 1)))
+
+    # Liked sets of 1-5 rated books, like the frontend sends
+    rated = np.unique(meta["item_idx"])
+    queries = [rec.item_ids[i] for i in rng.choice(rated, 5 * n_requests)]
+    liked_sets = [queries[5 * i:5 * i + rng.integers(1, 6)] for i in range(n_requests)]
+
+    pipeline = RecommendationPipeline()
+    latency = {"recommend": [], "pipeline": []}
+    for liked in liked_sets:
+        start = time.perf_counter()
+        rec.recommend(liked, k=10)
+        latency["recommend"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        pipeline.recommend(rec, liked, k=10)
+        latency["pipeline"].append((time.perf_counter() - start) * 1000)
+    result["latency"] = {name: _percentiles(samples) for name, samples in latency.items()}
+
+    user_ids = rng.choice(meta["user_ids"], batch_size)
+    batch = [(u, liked_sets[i % n_requests]) for i, u in enumerate(user_ids.tolist())]
+    start = time.perf_counter()
+    n = sum(1 for _ in rec.recommend_batch(batch, k=10))
+    elapsed = time.perf_counter() - start
+    result["batch"] = {"requests": n, "seconds": round(elapsed, 3), "req_per_s": round(n / elapsed, 1)}
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Metrics that got worse than baseline by more than `tolerance`; lower is better for all but throughput."""
+    regressions = []
+    old_sizes = {r["n_items"]: r for r in baseline["results"]}
+    for new in report["results"]:
+        old = old_sizes.get(new["n_items"])
+        if old is None:
+            continue
+        checks = [(f"fit_s.{k}", old["fit_s"].get(k), v, False) for k, v in new["fit_s"].items()]
+        checks += [(f"latency.{name}.{p}", old["latency"][name][p], v, False)
+                   for name, stats in new["latency"].items() for p, v in stats.items()
+                   if name in old["latency"] and p != "max_ms"]
+        checks.append(("batch.req_per_s", old["batch"]["req_per_s"], new["batch"]["req_per_s"], True))
+        checks.append(("peak_rss_mb", old["peak_rss_mb"], new["peak_rss_mb"], False))
+        for name, before, after, higher_is_better in checks:
+            if not before:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({"n_items": new["n_items"], "metric": name,
+                                    "baseline": before, "current": after,
+                                    "change": round(change, 3)})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommender latency/throughput benchmarks")
+    parser.add_argument("--sizes", default="10k,100k,1M", help="comma-separated catalog sizes")
+    parser.add_argument("--requests", type=int, default=500, help="single requests per size")
+    parser.add_argument("--batch", type=int, default=5000, help="queries in the batch run")
+    parser.add_argument("--neighbours", action="store_true", help="also time the content neighbour table")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report", default="reports/benchmark.json")
+    parser.add_argument("--baseline", default=None, help="earlier report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "config": {"requests": args.requests, "batch": args.batch,
+                   "neighbours": args.neighbours, "seed": args.seed},
+        "results": [],
+    }
+    for size in args.sizes.split(","):
+        n_items = parse_size(size.strip())
+        print(f"📊 Benchmarking {n_items} items...")
+        # One process per size so peak RSS isn't carried over from a larger run
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_size, n_items, args.requests, args.batch,
+                                 args.neighbours, args.seed).result()
+        report["results"].append(result)
+        lat = result["latency"]
+        print(f"   fit_cf {result['fit_s']['fit_cf']}s, recommend p99 {lat['recommend']['p99_ms']}ms, "
+              f"pipeline p99 {lat['pipeline']['p99_ms']}ms, batch {result['batch']['req_per_s']} req/s, "
+              f"peak {result['peak_rss_mb']} MB")
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Report written to {args.report}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print(f"⚠️ Baseline ran with {baseline.get('config')}, not comparable metric for metric")
+        regressions = compare(report, baseline, args.tolerance)
+        for r in regressions:
+            print(f"⚠️ {r['n_items']} items: {r['metric']} {r['baseline']} -> {r['current']} ({r['change']:+.0%})")
+        sys.exit(1 if regressions else 0)
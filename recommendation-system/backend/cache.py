@@ -0,0 +1,266 @@
+# backend/cache.py
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL for /recommend results.
+    Memory is bounded by max_entries. clear() bumps a generation counter;
+    a result computed before the clear (e.g. against a model that has
+    since been reloaded) is dropped by put() instead of being cached.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(liked_book_ids, k, exclude_book_ids=(), segments=(), user_id=None):
+        """
+        Order-insensitive key: the same liked/excluded sets, k, segments
+        and user (known users get their rated books filtered) share an entry.
+        """
+        return (tuple(sorted(set(liked_book_ids))), k,
+                tuple(sorted(set(exclude_book_ids))), tuple(segments), user_id)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, generation=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "generation": self.generation,
+            }
+
+
+class UserProfileCache:
+    """
+    LRU cache of known users' scoring profiles (Recommender.profile: the
+    summed CF item vectors and summed content rows of their liked books),
+    so a repeat visitor's request skips rebuilding them. When the liked
+    set changed since the cached entry, e.g. after rating another book,
+    only the added and removed books are summed into the entry.
+
+    Entries are only valid for the model they were built from; the cache
+    binds to one model (weakly, so a reloaded-away model can be freed)
+    and starts over when another one is passed. With spill_dir, evicted
+    entries are written there as .npz files and read back on a miss
+    instead of being rebuilt. Spill files belong to a generation of the
+    cache that ends with every rebind or clear(); files are only renamed
+    into place, and read entries only used, while it is still current.
+    Each generation spills into its own <pid>-<instance>-<generation>
+    subdirectory, so server workers sharing spill_dir never read or clear
+    each other's files.
+    """
+
+    def __init__(self, max_entries=10000, spill_dir=None):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.hits = 0
+        self.updates = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spill_hits = 0
+        self._model = None
+        self._generation = 0
+        self._instance = uuid.uuid4().hex[:8]
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, model, user_id, rows):
+        """(CF sum, content sum) of `rows` for user_id, from the cache where possible."""
+        with self._lock:
+            self._bind(model)
+            generation = self._generation
+            entry = self._data.get(user_id)
+        spilled = False
+        if entry is None and self.spill_dir:
+            entry = self._read_spill(user_id, generation)
+            with self._lock:
+                # Written for whatever model the cache was bound to meanwhile
+                if self._generation != generation:
+                    entry = None
+            spilled = entry is not None
+
+        if entry is None:
+            profile, outcome = model.profile(rows), "misses"
+        else:
+            cached_rows, cf, content = entry
+            old, new = Counter(cached_rows.tolist()), Counter(rows.tolist())
+            added = np.fromiter((new - old).elements(), dtype=np.int64)
+            removed = np.fromiter((old - new).elements(), dtype=np.int64)
+            if not len(added) and not len(removed):
+                profile, outcome = (cf, content), "hits"
+            elif len(added) + len(removed) >= len(rows):
+                # Mostly a different set: summing from scratch is cheaper
+                profile, outcome = model.profile(rows), "misses"
+            else:
+                profile = (cf, content)
+                if len(added):
+                    profile = _combine(profile, model.profile(added), 1)
+                if len(removed):
+                    profile = _combine(profile, model.profile(removed), -1)
+                outcome = "updates"
+
+        evicted = []
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.spill_hits += spilled
+            # A reload may have rebound the cache meanwhile; don't mix models
+            if self._model is not None and self._model() is model:
+                self._data[user_id] = (np.sort(rows), *profile)
+                self._data.move_to_end(user_id)
+                while len(self._data) > self.max_entries:
+                    evicted.append(self._data.popitem(last=False))
+                    self.evictions += 1
+        if self.spill_dir:
+            for evicted_id, evicted_entry in evicted:
+                self._write_spill(evicted_id, evicted_entry, generation)
+        return profile
+
+    def _bind(self, model):
+        if self._model is None or self._model() is not model:
+            self._model = weakref.ref(model)
+            self._reset()
+
+    def clear(self):
+        with self._lock:
+            self._model = None
+            self._reset()
+
+    def _reset(self):
+        self._clear_spill()
+        self._generation += 1
+        self._data.clear()
+
+    def _generation_dir(self, generation):
+        # pid too: a worker forked after the cache was made shares _instance
+        return os.path.join(self.spill_dir, f"{os.getpid()}-{self._instance}-{generation}")
+
+    def _spill_path(self, user_id, generation):
+        name = hashlib.sha1(repr(user_id).encode()).hexdigest()
+        return os.path.join(self._generation_dir(generation), f"{name}.npz")
+
+    def _write_spill(self, user_id, entry, generation):
+        rows, cf, content = entry
+        arrays = {"rows": rows, "content_indices": content.indices,
+                  "content_data": content.data, "n_features": content.shape[1]}
+        if cf is not None:
+            arrays["cf"] = cf
+        # Written under a temp name outside the generation directory so a
+        # reader never sees half a file and a reset can't remove it midway,
+        # then renamed in under the lock so a rebind can't happen in between
+        path = self._spill_path(user_id, generation)
+        tmp_path = os.path.join(self.spill_dir, f"{os.getpid()}-{self._instance}-{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        with self._lock:
+            if self._generation == generation:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                return
+        os.remove(tmp_path)
+
+    def _read_spill(self, user_id, generation):
+        path = self._spill_path(user_id, generation)
+        try:
+            with np.load(path) as f:
+                content = csr_matrix(
+                    (f["content_data"], f["content_indices"], [0, len(f["content_indices"])]),
+                    shape=(1, int(f["n_features"])),
+                )
+                cf = f["cf"] if "cf" in f.files else None
+                entry = (f["rows"], cf, content)
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+        _remove(path)
+        return entry
+
+    def _clear_spill(self):
+        # Only this cache's current generation; other workers' stay
+        if self.spill_dir:
+            shutil.rmtree(self._generation_dir(self._generation), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.updates + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "updates": self.updates,
+                "misses": self.misses,
+                "spill_hits": self.spill_hits,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.updates) / lookups if lookups else 0.0,
+            }
+
+
+def _combine(profile, delta, sign):
+    cf, content = profile
+    delta_cf, delta_content = delta
+    if cf is not None:
+        cf = cf + sign * delta_cf
+    return cf, content + sign * delta_content
+
+
+def _remove(path):
+    # A concurrent miss for the same user may have taken the file already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,117 @@
+# backend/catalog_store.py
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = "manifest.json"
+# Category strings are stored as one UTF-8 blob separated by NUL bytes
+SEPARATOR = "\x00"
+
+
+def store_dir(csv_path):
+    """Columnar store location for a CSV: data/Books.csv -> data/Books.cols"""
+    return os.path.splitext(csv_path)[0] + ".cols"
+
+
+def _source_stamp(csv_path):
+    # Size and mtime are enough to notice an edited CSV without hashing it
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def fresh_store(csv_path):
+    """
+    The CSV's columnar store directory if it exists and was converted from
+    the CSV as it is now, else None. A store without its CSV next to it
+    is trusted as is.
+    """
+    path = store_dir(csv_path)
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            source = json.load(f).get("source")
+    except FileNotFoundError:
+        return None
+    if not os.path.exists(csv_path):
+        return path
+    return path if source == _source_stamp(csv_path) else None
+
+
+def _code_dtype(n_categories):
+    # Same widths pandas picks for categorical codes, so from_codes can
+    # use the memory-mapped array as is instead of copying it
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def convert_csv(csv_path, out_dir=None):
+    """
+    One-time conversion of a CSV into a directory of .npy columns.
+    Numeric columns are stored as is; everything else as categorical
+    codes plus a category blob.
+    """
+    out_dir = out_dir or store_dir(csv_path)
+    os.makedirs(out_dir, exist_ok=True)
+    # Stamped before reading, so an edit made mid-conversion reads as stale
+    source = _source_stamp(csv_path)
+    df = pd.read_csv(csv_path, low_memory=False)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        if pd.api.types.is_numeric_dtype(col):
+            np.save(os.path.join(out_dir, f"{i}.values.npy"), col.to_numpy())
+            columns.append({"name": name, "kind": "numeric"})
+            continue
+
+        codes, categories = pd.factorize(col.astype(str).where(col.notna()), sort=True)
+        blob = SEPARATOR.join(categories.tolist()).encode("utf-8")
+        np.save(os.path.join(out_dir, f"{i}.codes.npy"), codes.astype(_code_dtype(len(categories))))
+        np.save(os.path.join(out_dir, f"{i}.categories.npy"), np.frombuffer(blob, dtype=np.uint8))
+        columns.append({"name": name, "kind": "categorical", "n_categories": len(categories)})
+
+    # Manifest last, so a half-written store is never picked up
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump({"n_rows": len(df), "columns": columns, "source": source}, f, indent=2)
+    return out_dir
+
+
+def load_table(path):
+    """Load a converted store; column arrays are memory-mapped read-only."""
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    data = {}
+    for i, col in enumerate(manifest["columns"]):
+        if col["kind"] == "numeric":
+            data[col["name"]] = np.load(os.path.join(path, f"{i}.values.npy"), mmap_mode="r")
+            continue
+
+        codes = np.load(os.path.join(path, f"{i}.codes.npy"), mmap_mode="r")
+        blob = np.load(os.path.join(path, f"{i}.categories.npy"), mmap_mode="r")
+        categories = bytes(blob).decode("utf-8").split(SEPARATOR) if col["n_categories"] else []
+        data[col["name"]] = pd.Categorical.from_codes(codes, categories=categories, validate=False)
+    return pd.DataFrame(data, copy=False)
+
+
+def read_table(csv_path):
+    """
+    Read a table from its columnar store when one is up to date with the
+    CSV, else from the CSV (rerun the conversion to pick an edit up).
+    """
+    path = fresh_store(csv_path)
+    if path is not None:
+        return load_table(path)
+    return pd.read_csv(csv_path, low_memory=False)
+
+
+if __name__ == "__main__":
+    # One-time step: python catalog_store.py data/Books.csv data/Ratings.csv data/Users.csv
+    for csv_path in sys.argv[1:] or ["data/Books.csv", "data/Ratings.csv", "data/Users.csv"]:
+        print(f"⚙️ Converting {csv_path}...")
+        print(f"✅ Columnar store written to {convert_csv(csv_path)}")
@@ -0,0 +1,138 @@
+# backend/content_index.py
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from data_processing import clean_ids, iter_books_chunks
+
+MANIFEST = "manifest.json"
+TEXT_FIELDS = ["book-title", "book-author", "publisher"]
+
+
+def make_vectorizer(n_features=2**20):
+    """
+    Stateless term-count hasher, so the same text always lands in the same
+    columns and new items can be vectorised without refitting.
+    """
+    return HashingVectorizer(
+        n_features=n_features, stop_words="english", alternate_sign=False,
+        norm=None, dtype=np.float32,
+    )
+
+
+def _chunk_text(chunk, text_fields):
+    # Same "title author publisher" document as build_content_index
+    text = chunk[text_fields[0]].astype(object).fillna("").astype(str)
+    for field in text_fields[1:]:
+        text = text + " " + chunk[field].astype(object).fillna("").astype(str)
+    return text
+
+
+def _clean_chunks(books_csv, columns, chunksize):
+    """
+    Books chunks cleaned like train.clean: rows without an id dropped, ids
+    stripped, only the first row of each id kept, so index rows line up
+    with train.py's CF columns. Ids already seen are tracked as a sorted
+    array of 64-bit hashes, 8 bytes per book.
+    """
+    seen = np.empty(0, dtype=np.uint64)
+    for chunk in iter_books_chunks(books_csv, columns, chunksize):
+        chunk = chunk.loc[chunk["book_id"].notna()]
+        ids = clean_ids(chunk["book_id"])
+        hashes = pd.util.hash_array(ids.to_numpy(dtype=object))
+        keep = ~pd.Series(hashes).duplicated().to_numpy() & ~np.isin(hashes, seen)
+        seen = np.union1d(seen, hashes[keep])
+        chunk = chunk.loc[keep].copy()
+        chunk["book_id"] = ids[keep]
+        yield chunk
+
+
+def build_streaming_content_index(books_csv, out_dir, n_features=2**20,
+                                  chunksize=100_000, text_fields=None):
+    """
+    TF-IDF content matrix for catalogs that don't fit in memory.
+
+    Pass 1 hashes each chunk of books and accumulates document frequencies
+    (and the total nnz); pass 2 re-reads the chunks, applies the smoothed
+    IDF (same formula as TfidfVectorizer), L2-normalises the rows and
+    writes them and the item ids into pre-sized .npy files. Books are
+    cleaned as in train.clean (see _clean_chunks). Peak memory is one
+    chunk, the n_features document-frequency vector and 8 bytes per book
+    for id deduplication.
+    """
+    text_fields = text_fields or TEXT_FIELDS
+    columns = ["book_id"] + text_fields
+    vectorizer = make_vectorizer(n_features)
+    os.makedirs(out_dir, exist_ok=True)
+
+    doc_freq = np.zeros(n_features, dtype=np.int64)
+    n_rows = nnz = id_width = 0
+    for chunk in _clean_chunks(books_csv, columns, chunksize):
+        counts = vectorizer.transform(_chunk_text(chunk, text_fields))
+        # Hashed columns are unique per row, so each index is one document
+        doc_freq += np.bincount(counts.indices, minlength=n_features)
+        n_rows += counts.shape[0]
+        nnz += counts.nnz
+        if len(chunk):
+            id_width = max(id_width, int(chunk["book_id"].str.len().max()))
+
+    idf = (np.log((1 + n_rows) / (1 + doc_freq)) + 1).astype(np.float32)
+    # One index dtype for indptr and indices lets scipy keep the memmaps as is
+    index_dtype = np.int32 if max(nnz, n_features) < np.iinfo(np.int32).max else np.int64
+    data = open_memmap(os.path.join(out_dir, "data.npy"), "w+", np.float32, (nnz,))
+    indices = open_memmap(os.path.join(out_dir, "indices.npy"), "w+", index_dtype, (nnz,))
+    indptr = open_memmap(os.path.join(out_dir, "indptr.npy"), "w+", index_dtype, (n_rows + 1,))
+    ids = open_memmap(os.path.join(out_dir, "item_ids.npy"), "w+", f"<U{max(id_width, 1)}", (n_rows,))
+    indptr[0] = 0
+
+    row = pos = 0
+    for chunk in _clean_chunks(books_csv, columns, chunksize):
+        block = vectorizer.transform(_chunk_text(chunk, text_fields))
+        block.data *= idf[block.indices]
+        block = normalize(block, copy=False)
+        end = pos + block.nnz
+        data[pos:end] = block.data
+        indices[pos:end] = block.indices
+        indptr[row + 1:row + 1 + block.shape[0]] = pos + block.indptr[1:]
+        ids[row:row + block.shape[0]] = chunk["book_id"].to_numpy(dtype=str)
+        row += block.shape[0]
+        pos = end
+    for array in (data, indices, indptr, ids):
+        array.flush()
+    # Manifest last, so a half-written index is never picked up
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump({"shape": [n_rows, n_features], "nnz": int(nnz),
+                   "text_fields": text_fields}, f, indent=2)
+    return out_dir
+
+
+def load_content_index(path, mmap=True):
+    """(content_matrix, item_ids, vectorizer); CSR arrays memory-mapped read-only by default."""
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    mode = "r" if mmap else None
+    data, indices, indptr = (
+        np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+        for name in ("data", "indices", "indptr")
+    )
+    matrix = csr_matrix((data, indices, indptr), shape=tuple(manifest["shape"]), copy=False)
+    item_ids = np.load(os.path.join(path, "item_ids.npy")).tolist()
+    return matrix, item_ids, make_vectorizer(manifest["shape"][1])
+
+
+if __name__ == "__main__":
+    # python content_index.py data/Books.csv models/content [n_features]
+    books_csv = sys.argv[1] if len(sys.argv) > 1 else "data/Books.csv"
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else "models/content"
+    n_features = int(sys.argv[3]) if len(sys.argv) > 3 else 2**20
+    print(f"⚙️ Indexing {books_csv}...")
+    build_streaming_content_index(books_csv, out_dir, n_features=n_features)
+    print(f"✅ Content index written to {out_dir}")
@@ -1,16 +1,18 @@
 # backend/data_processing.py
 
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import LabelEncoder
-from scipy.sparse import csr_matrix
+from scipy.sparse import coo_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+from catalog_store import fresh_store, load_table, read_table
+
 
 def load_raw_data(ratings_csv, books_csv, users_csv):
-    """Load Ratings, Books, and Users data from Kaggle CSV files"""
-    ratings = pd.read_csv(ratings_csv, low_memory=False)
-    books = pd.read_csv(books_csv, low_memory=False)
-    users = pd.read_csv(users_csv, low_memory=False)
+    """Load Ratings, Books, and Users data from Kaggle CSV files (or their columnar stores)"""
+    ratings = read_table(ratings_csv)
+    books = read_table(books_csv)
+    users = read_table(users_csv)
 
     # Normalize column names to lowercase
     ratings.columns = [c.strip().lower() for c in ratings.columns]
@@ -33,25 +35,117 @@ def load_raw_data(ratings_csv, books_csv, users_csv):
     return ratings, books, users
 
 
-def build_user_item_matrix(ratings):
-    """Build sparse user-item matrix for Collaborative Filtering"""
-    user_encoder = LabelEncoder()
-    item_encoder = LabelEncoder()
+def iter_ratings_chunks(ratings_csv, chunksize=200_000):
+    """Stream Ratings.csv in chunks with the same column names as load_raw_data"""
+    for chunk in pd.read_csv(ratings_csv, chunksize=chunksize, dtype={"ISBN": str}):
+        chunk.columns = [c.strip().lower() for c in chunk.columns]
+        yield chunk.rename(columns={"isbn": "book_id", "user-id": "user_id"})
 
-    ratings["user_idx"] = user_encoder.fit_transform(ratings["user_id"])
-    ratings["item_idx"] = item_encoder.fit_transform(ratings["book_id"])
 
-    matrix = csr_matrix(
-        (ratings["book-rating"], (ratings["user_idx"], ratings["item_idx"]))
-    )
+def clean_ids(col):
+    """Ids as stripped strings, missing values kept as NaN (train.py's cleaning)."""
+    return col.astype(object).where(col.notna()).astype(str).str.strip()
+
+
+def iter_books_chunks(books_csv, columns, chunksize=100_000):
+    """
+    Stream Books.csv in chunks, keeping only `columns` (lowercased names,
+    ISBN as book_id). Up-to-date columnar stores are sliced instead of re-parsed.
+    """
+    wanted = {"isbn" if c == "book_id" else c for c in columns}
+    store = fresh_store(books_csv)
+    if store is not None:
+        table = load_table(store)
+        table.columns = [c.strip().lower() for c in table.columns]
+        table = table[[c for c in table.columns if c in wanted]]
+        chunks = (table.iloc[i:i + chunksize] for i in range(0, len(table), chunksize))
+    else:
+        chunks = pd.read_csv(books_csv, chunksize=chunksize, dtype=str,
+                             usecols=lambda c: c.strip().lower() in wanted)
+    for chunk in chunks:
+        chunk.columns = [c.strip().lower() for c in chunk.columns]
+        yield chunk.rename(columns={"isbn": "book_id"})
+
+
+def _encode(values, index):
+    """Codes for values against a growing id index; unseen ids are appended."""
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques)
+    if index is None:
+        return codes, pd.Index(uniques)
+    pos = index.get_indexer(uniques)
+    new = pos == -1
+    pos[new] = len(index) + np.arange(new.sum())
+    index = index.append(pd.Index(uniques[new]))
+    return np.where(codes >= 0, pos[codes], -1), index
+
+
+def _finish_codes(codes, index, sort):
+    """Final (codes, ids); with sort, renumbered into sorted id order like LabelEncoder"""
+    ids = index.to_numpy()
+    if not sort:
+        return codes, ids
+    order = np.argsort(ids, kind="stable")
+    remap = np.empty(len(order), dtype=np.int32)
+    remap[order] = np.arange(len(order), dtype=np.int32)
+    return remap[codes], ids[order]
 
-    meta = {
-        "user_encoder": user_encoder,
-        "item_encoder": item_encoder,
-        "df": ratings,
-        "n_items": len(item_encoder.classes_),
-        "n_users": len(user_encoder.classes_),
+
+def encode_ratings(ratings, rating_col="book-rating", dtype=np.float32,
+                   user_ids=None, item_ids=None):
+    """
+    Integer-encode ratings for the user-item matrix.
+    `ratings` is a DataFrame or an iterable of DataFrame chunks (see
+    iter_ratings_chunks); it is never mutated. Per rating only int32
+    codes and one `dtype` value are kept, so chunked input is encoded in
+    bounded memory.
+    Passing the user_ids/item_ids of an earlier build keeps their rows
+    and columns and appends unseen ids after them, which is the layout
+    Recommender.partial_fit_cf expects.
+    """
+    chunks = [ratings] if isinstance(ratings, pd.DataFrame) else ratings
+    user_index = None if user_ids is None else pd.Index(user_ids)
+    item_index = None if item_ids is None else pd.Index(item_ids)
+    user_codes, item_codes, values = [], [], []
+    for chunk in chunks:
+        u, user_index = _encode(chunk["user_id"], user_index)
+        i, item_index = _encode(chunk["book_id"], item_index)
+        valid = (u >= 0) & (i >= 0)
+        user_codes.append(u[valid].astype(np.int32))
+        item_codes.append(i[valid].astype(np.int32))
+        values.append(chunk[rating_col].to_numpy(dtype=dtype)[valid])
+
+    user_idx, user_ids = _finish_codes(np.concatenate(user_codes), user_index, user_ids is None)
+    item_idx, item_ids = _finish_codes(np.concatenate(item_codes), item_index, item_ids is None)
+    return {
+        "user_ids": user_ids,
+        "item_ids": item_ids,
+        "user_idx": user_idx,
+        "item_idx": item_idx,
+        "values": np.concatenate(values),
+        "n_items": len(item_ids),
+        "n_users": len(user_ids),
     }
+
+
+def ratings_to_csr(encoded):
+    """CSR user-item matrix from encode_ratings output; duplicate pairs are summed."""
+    return coo_matrix(
+        (encoded["values"], (encoded["user_idx"], encoded["item_idx"])),
+        shape=(encoded["n_users"], encoded["n_items"]),
+    ).tocsr()
+
+
+def build_user_item_matrix(ratings, rating_col="book-rating", dtype=np.float32,
+                           user_ids=None, item_ids=None):
+    """
+    Build sparse user-item matrix for Collaborative Filtering.
+    Same arguments as encode_ratings; returns (matrix, meta) where meta
+    holds the ids and per-rating codes.
+    """
+    meta = encode_ratings(ratings, rating_col, dtype, user_ids, item_ids)
+    matrix = ratings_to_csr(meta)
+    del meta["values"]
     return matrix, meta
 
 
@@ -59,8 +153,11 @@ def build_content_index(books, text_fields=None):
     """
     Build TF-IDF content matrix for book metadata.
     Kaggle dataset has: book-title, book-author, publisher
+    Fits in memory; content_index.py builds the same matrix out of core
+    for catalogs that don't.
     """
-    books = books.fillna("")
+    # object first: categorical columns from the columnar store can't fillna("")
+    books = books[["book-title", "book-author", "publisher"]].astype(object).fillna("")
     books["content"] = (
         books["book-title"].astype(str)
         + " "
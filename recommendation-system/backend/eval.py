@@ -1,56 +1,197 @@
 # backend/eval.py
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-from sklearn.model_selection import train_test_split
+import pandas as pd
 from data_processing import build_user_item_matrix, load_raw_data
-from recommender import Recommender
-import joblib
-
-def precision_recall_at_k(recommended_list, test_positive_set, k):
-    rec_k = recommended_list[:k]
-    hits = len([r for r in rec_k if r in test_positive_set])
-    prec = hits / k
-    rec = hits / len(test_positive_set) if len(test_positive_set)>0 else 0.0
-    f1 = 2*prec*rec/(prec+rec) if (prec+rec)>0 else 0.0
-    return prec, rec, f1
-
-def evaluate(ratings_path, books_path, k=10):
-    ratings, books = load_raw_data(ratings_path, books_path)
-    train, test = train_test_split(ratings, test_size=0.2, random_state=42, stratify=ratings['user_id'])
-    # build training matrix
+from recommender import Recommender, top_k_rows
+
+# Set once per worker process by _init_worker
+_STATE = {}
+
+
+def _discounts(k):
+    return 1.0 / np.log2(np.arange(2, k + 2))
+
+
+def batch_metrics(top, user_rows, test_keys, n_pos, n_items, k):
+    """
+    Precision/recall/F1/NDCG@k for a block of users at once.
+    top: (n_users, k) recommended item rows; test positives are encoded
+    as sorted user_row * n_items + item_row keys.
+    """
+    keys = user_rows[:, None].astype(np.int64) * n_items + top
+    pos = np.searchsorted(test_keys, keys)
+    pos[pos == len(test_keys)] = 0
+    hits = test_keys[pos] == keys if len(test_keys) else np.zeros(keys.shape, dtype=bool)
+
+    disc = _discounts(k)
+    n_hits = hits.sum(axis=1)
+    pos_count = n_pos[user_rows]
+    prec = n_hits / k
+    rec = np.divide(n_hits, pos_count, out=np.zeros(len(n_hits)), where=pos_count > 0)
+    f1 = np.divide(2 * prec * rec, prec + rec, out=np.zeros(len(n_hits)), where=(prec + rec) > 0)
+    ideal = np.concatenate([[0.0], np.cumsum(disc)])[np.minimum(pos_count, k)]
+    ndcg = np.divide((hits * disc[:top.shape[1]]).sum(axis=1), ideal, out=np.zeros(len(n_hits)), where=ideal > 0)
+    return np.stack([prec, rec, f1, ndcg], axis=1)
+
+
+# Peak bytes per (user, item) cell while scoring a block: float32 scores
+# plus top_k_rows' int64 argpartition result
+BYTES_PER_CELL = 4 + 8
+
+
+def batch_rows(n_items, memory_mb=1024, n_jobs=1):
+    """Users per score block so n_jobs concurrent blocks stay within memory_mb in total."""
+    budget = memory_mb * 2 ** 20 // max(n_jobs, 1)
+    return int(max(1, min(4096, budget // (BYTES_PER_CELL * max(n_items, 1)))))
+
+
+def _init_worker(rec, train, test_keys, n_pos, k, batch_size):
+    _STATE.update(rec=rec, train=train, test_keys=test_keys, n_pos=n_pos, k=k, batch_size=batch_size,
+                  factors=rec.cf_model.components_.astype(np.float32))
+
+
+def _score_users(user_rows):
+    """Metrics for known users: dense float32 CF score blocks with train items masked."""
+    rec, train, k = _STATE["rec"], _STATE["train"], _STATE["k"]
+    out = []
+    for start in range(0, len(user_rows), _STATE["batch_size"]):
+        rows = user_rows[start:start + _STATE["batch_size"]]
+        scores = rec.score_users(rows, _STATE["factors"])
+        seen = train[rows]
+        scores[np.repeat(np.arange(len(rows)), np.diff(seen.indptr)), seen.indices] = -np.inf
+        top = top_k_rows(scores, k)
+        out.append(batch_metrics(top, rows, _STATE["test_keys"], _STATE["n_pos"], train.shape[1], k))
+    return np.concatenate(out) if out else np.empty((0, 4))
+
+
+def split_ratings(ratings, test_size=0.2, seed=42):
+    """Reproducible per-rating train/test split."""
+    mask = np.random.default_rng(seed).random(len(ratings)) < test_size
+    return ratings[~mask], ratings[mask]
+
+
+def evaluate(ratings_path, books_path, users_path, k=10, test_size=0.2, seed=42,
+             n_jobs=None, batch_size=None, report_path=None, cf_engine="svd", memory_mb=1024):
+    timings = {}
+    clock = time.perf_counter()
+
+    def lap(stage):
+        nonlocal clock
+        now = time.perf_counter()
+        timings[stage] = round(now - clock, 3)
+        clock = now
+
+    ratings, _, _ = load_raw_data(ratings_path, books_path, users_path)
+    lap("load")
+    train, test = split_ratings(ratings, test_size, seed)
+    lap("split")
     user_item_matrix, meta = build_user_item_matrix(train)
-    rec = Recommender()
-    rec.fit_cf(user_item_matrix)
-    # content
-    item_ids_list = meta['item_encoder'].classes_.tolist()
-    books_filtered = books[books['book_id'].isin(item_ids_list)].set_index('book_id').loc[item_ids_list].reset_index()
-    from data_processing import build_content_index
-    content_matrix, tfidf = build_content_index(books_filtered)
-    rec.fit_content(content_matrix, item_ids_list, tfidf)
-
-    # per-user evaluation
-    users = test['user_id'].unique()
-    precs, recs, f1s = [], [], []
-    for u in users:
-        # user test positives
-        user_test = test[test['user_id']==u]
-        pos_book_ids = set(user_test['book_id'].tolist())
-        if len(pos_book_ids) == 0:
-            continue
-        # map user id to train index if exists
-        ue = meta['user_encoder']
-        try:
-            uidx = int(ue.transform([u])[0])
-            recs_list = [r[0] for r in rec.recommend_for_user(user_idx=uidx, user_item_matrix=user_item_matrix, top_k=k)]
-        except Exception:
-            # cold-start user: create profile from no items -> skip or use popularity
-            recs_list = [r[0] for r in rec.popularity_ranking[:k]]
-
-        p, r_, f = precision_recall_at_k(recs_list, pos_book_ids, k)
-        precs.append(p); recs.append(r_); f1s.append(f)
-
-    print(f"Precision@{k}: {np.mean(precs):.4f}")
-    print(f"Recall@{k}: {np.mean(recs):.4f}")
-    print(f"F1@{k}: {np.mean(f1s):.4f}")
+    user_item_matrix.sort_indices()
+    lap("build_matrix")
+    rec = Recommender(cf_engine=cf_engine)
+    rec.fit_cf(user_item_matrix, user_ids=meta['user_ids'])
+    lap("fit_cf")
+
+    # Group test positives once: known users keep their train row, cold-start
+    # users get rows after them. Only items seen in training can be hit.
+    n_users, n_items = meta["n_users"], meta["n_items"]
+    test_users = pd.Index(test["user_id"].unique())
+    user_rows = pd.Index(meta["user_ids"]).get_indexer(test_users)
+    cold = user_rows < 0
+    user_rows[cold] = n_users + np.arange(cold.sum())
+
+    test_user_rows = user_rows[test_users.get_indexer(test["user_id"])]
+    test_item_rows = pd.Index(meta["item_ids"]).get_indexer(test["book_id"])
+    n_pos = np.bincount(test_user_rows, minlength=n_users + cold.sum())
+    known_item = test_item_rows >= 0
+    test_keys = np.unique(test_user_rows[known_item].astype(np.int64) * n_items + test_item_rows[known_item])
+    lap("group_test")
+
+    warm_rows = np.sort(user_rows[~cold])
+    n_jobs = n_jobs or os.cpu_count() or 1
+    # memory_mb bounds the score blocks of all workers together
+    batch_size = batch_size or batch_rows(n_items, memory_mb, n_jobs)
+    state = (rec, user_item_matrix, test_keys, n_pos, k, batch_size)
+    if n_jobs == 1:
+        _init_worker(*state)
+        warm = _score_users(warm_rows)
+    else:
+        parts = np.array_split(warm_rows, n_jobs * 4)
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=state) as pool:
+            warm = np.concatenate(list(pool.map(_score_users, parts)))
+
+    # Cold-start users all get the same most-rated items
+    popular = np.argsort(-np.bincount(meta["item_idx"], minlength=n_items), kind="stable")[:k]
+    cold_rows = user_rows[cold]
+    cold_metrics = batch_metrics(
+        np.broadcast_to(popular, (len(cold_rows), len(popular))), cold_rows, test_keys, n_pos, n_items, k
+    )
+    lap("score")
+
+    per_user = np.concatenate([warm, cold_metrics])
+    metrics = dict(zip(["precision", "recall", "f1", "ndcg"], per_user.mean(axis=0).round(6).tolist()))
+    report = {
+        "cf_engine": cf_engine,
+        "k": k,
+        "test_size": test_size,
+        "seed": seed,
+        "n_jobs": n_jobs,
+        "batch_size": batch_size,
+        "n_users": int(len(per_user)),
+        "n_cold_start_users": int(cold.sum()),
+        "metrics": {f"{name}@{k}": value for name, value in metrics.items()},
+        "timings_s": timings,
+    }
+
+    for name, value in report["metrics"].items():
+        print(f"{name}: {value:.4f}")
+    print(f"⏱️ {timings}")
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {report_path}")
+    return report
+
 
 if __name__ == "__main__":
-    evaluate("data/ratings.csv", "data/books.csv", k=10)
+    parser = argparse.ArgumentParser(description="Offline evaluation of the CF recommender")
+    parser.add_argument("--ratings", default="data/Ratings.csv")
+    parser.add_argument("--books", default="data/Books.csv")
+    parser.add_argument("--users", default="data/Users.csv")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="users per score block (default: derived from --memory-mb)")
+    parser.add_argument("--memory-mb", type=int, default=1024,
+                        help="budget for the score blocks of all workers together")
+    parser.add_argument("--cf-engine", nargs="+", default=["svd"], choices=["svd", "als"],
+                        help="several engines are evaluated on the same split for comparison")
+    parser.add_argument("--report", default="reports/eval.json")
+    args = parser.parse_args()
+
+    reports = {}
+    for engine in args.cf_engine:
+        print(f"📊 Evaluating cf_engine={engine}")
+        path = args.report
+        if len(args.cf_engine) > 1:
+            root, ext = os.path.splitext(args.report)
+            path = f"{root}_{engine}{ext}"
+        reports[engine] = evaluate(args.ratings, args.books, args.users, k=args.k,
+                                   test_size=args.test_size, seed=args.seed, n_jobs=args.jobs,
+                                   batch_size=args.batch_size, report_path=path, cf_engine=engine,
+                                   memory_mb=args.memory_mb)
+
+    if len(reports) > 1:
+        print(f"{'engine':<8}{'fit_cf s':>10}{'precision@' + str(args.k):>16}")
+        for engine, report in reports.items():
+            print(f"{engine:<8}{report['timings_s']['fit_cf']:>10.3f}"
+                  f"{report['metrics'][f'precision@{args.k}']:>16.4f}")
@@ -0,0 +1,103 @@
+# backend/metrics.py
+
+import bisect
+import threading
+
+# Seconds; dense below 100ms where the /recommend p99 lives
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Prometheus histogram with a fixed label set. observe() is one bisect
+    and a few adds under a lock; per-bucket counts are kept plain and
+    only made cumulative when rendered.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """labels: tuple of values in labelnames order."""
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # one slot per bucket plus +Inf, then sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(snapshot.items()):
+            base = dict(zip(self.labelnames, labels))
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                total += count
+                lines.append(_sample(f"{self.name}_bucket", {**base, "le": _number(bound)}, total))
+            lines.append(_sample(f"{self.name}_sum", base, series[-1]))
+            lines.append(_sample(f"{self.name}_count", base, total))
+        return lines
+
+
+def family(name, kind, help, samples):
+    """Exposition lines of one gauge/counter family; samples are (labels dict, value)."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(_sample(name, labels, value) for labels, value in samples)
+    return lines
+
+
+class Registry:
+    """
+    Histograms observed on the hot path plus collectors, fn() -> lines,
+    that read counters the app already keeps (cache, executor, model
+    stats) only when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, help, labelnames, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        for collect in self.collectors:
+            lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    if value == "+Inf":
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample(name, labels, value):
+    if labels:
+        body = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{body}}} {_number(value)}"
+    return f"{name} {_number(value)}"
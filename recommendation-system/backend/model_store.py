@@ -0,0 +1,76 @@
+# backend/model_store.py
+
+import os
+import shutil
+import sys
+import time
+
+# models/
+#   CURRENT              name of the live version (replaced atomically)
+#   versions/<version>/  recommender artifacts + optional cf_ann.npz
+CURRENT = "CURRENT"
+VERSIONS = "versions"
+
+
+def version_dir(root, version):
+    return os.path.join(root, VERSIONS, version)
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def publish(src_dir, root="models", version=None, keep=3):
+    """
+    Copy a directory of trained artifacts into a new version and make it
+    current. The version directory is fully written before CURRENT is
+    flipped, so a watcher never sees a partial model. Keeps the newest
+    `keep` versions (the live one always survives).
+    """
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    target = version_dir(root, version)
+    staging = f"{target}.staging"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(src_dir, staging)
+    os.rename(staging, target)
+    _write_atomic(os.path.join(root, CURRENT), version)
+    prune(root, keep)
+    return version
+
+
+def prune(root, keep=3):
+    live = current_version(root)
+    versions_root = os.path.join(root, VERSIONS)
+    versions = sorted(
+        (v for v in os.listdir(versions_root) if not v.endswith(".staging")),
+        key=lambda v: os.path.getmtime(os.path.join(versions_root, v)),
+        reverse=True,
+    )
+    for version in versions[keep:]:
+        if version != live:
+            shutil.rmtree(os.path.join(versions_root, version), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # python model_store.py publish <artifact_dir> [version]
+    # python model_store.py current
+    command = sys.argv[1] if len(sys.argv) > 1 else "current"
+    if command == "publish":
+        version = publish(sys.argv[2], version=sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"✅ Published model version {version}")
+    else:
+        print(current_version("models") or "no current version")
@@ -0,0 +1,239 @@
+# backend/pipeline.py
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from popularity import GLOBAL_SEGMENT
+from recommender import top_k
+
+
+# --- Stage 1: candidate sources -------------------------------------------
+# A source is fn(model, liked_rows, n) -> item rows. Sources must stay cheap
+# (index lookups, precomputed tables), never a pass over the whole catalog.
+
+def cf_neighbours(model, rows, n):
+    """Nearest items to the liked items' mean CF vector via the ANN index."""
+    if model.cf_index is None or model.cf_model is None:
+        return np.empty(0, dtype=np.int64)
+    query = model.cf_item_vectors[rows].mean(axis=0)
+    items, _ = model.cf_index.search(query, k=n, exclude=rows)
+    return items
+
+
+def content_neighbours(model, rows, n):
+    """Top-n of the liked items' precomputed content neighbours."""
+    if model.neighbor_idx is None:
+        return np.empty(0, dtype=np.int64)
+    items, sims = model._content_from_neighbors(rows)
+    return items[top_k(sims, n)]
+
+
+def popular(model, rows, n):
+    """Head of the popularity ranking, so sparse profiles still fill k."""
+    if not model.popularity:
+        return np.empty(0, dtype=np.int64)
+    return model.popularity[GLOBAL_SEGMENT][0][:n]
+
+
+DEFAULT_SOURCES = (
+    ("cf", cf_neighbours, 200),
+    ("content", content_neighbours, 200),
+    ("popularity", popular, 50),
+)
+
+
+# --- Stage 2 helpers --------------------------------------------------------
+
+def diversify(model, items, scores, k, threshold=0.9):
+    """
+    Greedy near-duplicate suppression: walk candidates best-first and skip
+    any whose content similarity to an already picked item is >= threshold
+    (e.g. another edition of the same book). Only the best few * k are
+    compared, as one small dense similarity block. Returns positions into
+    items, best-first; too few distinct items are topped up in score order.
+    """
+    order = top_k(scores, 3 * k)
+    if model.content_matrix is None or len(order) <= 1:
+        return order[:k]
+    block = model.content_matrix[items[order]]
+    sims = block.dot(block.T).toarray()
+
+    picked = []
+    for i in range(len(order)):
+        if not picked or sims[i, picked].max() < threshold:
+            picked.append(i)
+            if len(picked) == k:
+                break
+    if len(picked) < k:
+        rest = np.setdiff1d(np.arange(len(order)), picked, assume_unique=True)
+        picked.extend(rest[:k - len(picked)].tolist())
+    return order[picked]
+
+
+def edition_keys(book_ids, titles, authors):
+    """
+    {book_id: normalised "title|author"} for spotting editions of one book:
+    case, punctuation and bracketed notes such as "(Paperback)" or
+    "(Book 1)" are dropped, so "J.K. Rowling" and "J. K. Rowling" agree.
+    """
+    def norm(values, bracketed=False):
+        text = pd.Series(values, dtype=object).fillna("").astype(str).str.lower()
+        if bracketed:
+            text = text.str.replace(r"[(\[][^)\]]*[)\]]", " ", regex=True)
+        return text.str.replace(r"[^0-9a-z]+", "", regex=True)
+
+    titles = norm(titles, bracketed=True)
+    keys = titles + "|" + norm(authors)
+    # Books without a usable title are only ever duplicates of themselves
+    return {b: key for b, key, title in zip(book_ids, keys.tolist(), titles.tolist()) if title}
+
+
+class MMR:
+    """
+    Maximal marginal relevance re-ranking, usable as the pipeline's
+    diversity step. The best pool * k candidates are first deduplicated
+    by edition key (one per title/author, best score kept), then picked
+    one at a time by
+
+        lam * relevance - (1 - lam) * max content similarity to the picked
+
+    with relevance min-max scaled to [0, 1] to match cosine similarities.
+    The pairwise similarities come from one small dense block, and each
+    candidate's max similarity to the picked set is updated with one
+    vectorised maximum per pick, so selection is O(k * n) over n <= pool * k.
+    """
+
+    def __init__(self, lam=0.7, pool=5, keys=None):
+        self.lam = lam
+        self.pool = pool
+        self.keys = keys
+
+    def dedup(self, model, items, order):
+        if not self.keys:
+            return order, order[:0]
+        first, dropped = {}, []
+        for pos in order.tolist():
+            book_id = model.item_ids[items[pos]]
+            key = self.keys.get(book_id, book_id)
+            if key in first:
+                dropped.append(pos)
+            else:
+                first[key] = pos
+        return np.fromiter(first.values(), dtype=np.int64), np.asarray(dropped, dtype=np.int64)
+
+    def __call__(self, model, items, scores, k):
+        order = top_k(scores, self.pool * k)
+        order, dropped = self.dedup(model, items, order)
+        if model.content_matrix is not None and len(order) > 1:
+            block = model.content_matrix[items[order]]
+            sims = block.dot(block.T).toarray()
+            rel = scores[order].astype(np.float64)
+            spread = rel.max() - rel.min()
+            rel = (rel - rel.min()) / spread if spread > 0 else np.ones_like(rel)
+
+            gain = self.lam * rel
+            max_sim = np.zeros(len(order))
+            picked = []
+            for _ in range(min(k, len(order))):
+                i = int(np.argmax(gain - (1 - self.lam) * max_sim))
+                picked.append(i)
+                gain[i] = -np.inf
+                np.maximum(max_sim, sims[i], out=max_sim)
+            order = order[picked]
+        # Too few distinct editions: top up with the duplicates, best first
+        return np.concatenate([order, dropped])[:k]
+
+
+class RecommendationPipeline:
+    """
+    Two-stage recommendation: cheap candidate sources pull a few hundred
+    items, then only those are scored with the hybrid CF + content score,
+    already-read items are filtered and the top is diversified. Cost is
+    bounded by the candidate count, not the catalog size.
+
+    Sources are (name, fn, n) triples (see DEFAULT_SOURCES) and the
+    diversity step is any fn(model, items, scores, k) -> positions (MMR by
+    default, diversify for the cheaper threshold filter; the server picks
+    with RECOMMEND_DIVERSITY), so both can be swapped per deployment. With a cache.UserProfileCache as profiles,
+    known users' liked-side profiles are reused across requests. Every
+    stage is timed; timings are
+    returned per call and kept as an exponentially weighted average.
+    """
+
+    def __init__(self, sources=DEFAULT_SOURCES, diversity=None, smoothing=0.2, profiles=None):
+        self.sources = list(sources)
+        self.diversity = diversity or MMR()
+        self.profiles = profiles
+        self.smoothing = smoothing
+        self.stage_ms = {}
+        self._lock = threading.Lock()
+
+    def recommend(self, model, liked_book_ids, k=10, exclude_book_ids=None, user_id=None):
+        """
+        (recommendations, {stage: ms}); empty when nothing can be scored.
+        Books user_id already rated are filtered with the excluded ones.
+        """
+        timings = {}
+        clock = time.perf_counter()
+
+        def lap(stage):
+            nonlocal clock
+            now = time.perf_counter()
+            timings[stage] = (now - clock) * 1000
+            clock = now
+
+        rows = model._rows_for(liked_book_ids or [])
+        if len(rows) == 0:
+            return [], timings
+
+        profile = None
+        if self.profiles is not None and user_id is not None:
+            profile = self.profiles.get(model, user_id, rows)
+            lap("profile")
+
+        scores = None
+        if model.neighbor_idx is None and model.cf_index is None:
+            # Models built without neighbour table or ANN index have no cheap
+            # source; score the whole catalog rather than serve popularity only
+            items, scores = model._hybrid_scores(rows, profile)
+            lap("full_scan")
+        else:
+            found = []
+            for name, source, n in self.sources:
+                found.append(np.asarray(source(model, rows, n), dtype=np.int64))
+                lap(f"source.{name}")
+            items = np.unique(np.concatenate(found))
+
+        seen = [rows, model.seen_rows(user_id)]
+        if exclude_book_ids:
+            seen.append(model._rows_for(exclude_book_ids))
+        keep = ~np.isin(items, np.concatenate(seen))
+        items = items[keep]
+        lap("filter")
+
+        recs = []
+        if len(items):
+            if scores is None:
+                scores = model.score_candidates(rows, items, profile)
+                lap("rank")
+            else:
+                scores = scores[keep]
+            top = self.diversity(model, items, scores, k)
+            lap("diversity")
+            recs = [{"book_id": model.item_ids[items[i]], "score": float(scores[i])} for i in top]
+
+        self._record(timings)
+        return recs, timings
+
+    def _record(self, timings):
+        with self._lock:
+            for stage, ms in timings.items():
+                prev = self.stage_ms.get(stage)
+                self.stage_ms[stage] = ms if prev is None else prev + self.smoothing * (ms - prev)
+
+    def stats(self):
+        with self._lock:
+            return {stage: round(ms, 3) for stage, ms in self.stage_ms.items()}
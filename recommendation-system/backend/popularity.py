@@ -0,0 +1,146 @@
+# backend/popularity.py
+
+import numpy as np
+import pandas as pd
+
+GLOBAL_SEGMENT = "all"
+# Upper bounds of the age buckets; the last bucket is open-ended
+AGE_EDGES = [18, 25, 35, 45, 55, 65]
+AGE_LABELS = ["<18", "18-24", "25-34", "35-44", "45-54", "55-64", "65+"]
+
+
+def age_segment(age):
+    """'age:25-34' style key, None for missing or implausible ages."""
+    if age is None or pd.isna(age) or not 5 <= age <= 100:
+        return None
+    return f"age:{AGE_LABELS[np.searchsorted(AGE_EDGES, age, side='right')]}"
+
+
+def location_segment(location):
+    """Country key from Book-Crossing 'city, state, country' locations."""
+    if location is None or pd.isna(location):
+        return None
+    country = str(location).rsplit(",", 1)[-1].strip().lower()
+    return f"country:{country}" if country and country != "n/a" else None
+
+
+def segments_for(age=None, location=None):
+    """Segment keys of a user, most specific first, ending with the global ranking."""
+    return [s for s in (location_segment(location), age_segment(age)) if s] + [GLOBAL_SEGMENT]
+
+
+def user_segments(users):
+    """Per-user segment keys (age bucket, country) as columns, indexed by user_id."""
+    users = users.drop_duplicates("user_id").set_index("user_id")
+    out = pd.DataFrame(index=users.index)
+    if "age" in users:
+        ages = pd.to_numeric(users["age"].astype(object), errors="coerce")
+        buckets = np.searchsorted(AGE_EDGES, ages.fillna(0).to_numpy(), side="right")
+        labels = np.array([f"age:{label}" for label in AGE_LABELS], dtype=object)[buckets]
+        out["age"] = np.where(ages.between(5, 100).to_numpy(), labels, None)
+    if "location" in users:
+        country = users["location"].astype(object).str.rsplit(",", n=1).str[-1].str.strip().str.lower()
+        valid = country.notna() & (country != "") & (country != "n/a")
+        out["country"] = np.where(valid.to_numpy(), "country:" + country.fillna(""), None)
+    return out
+
+
+def user_segment_keys(users, tables):
+    """
+    {user_id: (segment key, ...)} of the segments that have a ranking in
+    tables, most specific first like segments_for; users with none are
+    left out, so the server can pick a known user's ranking by id.
+    """
+    segments = user_segments(users)
+    columns = [c for c in ("country", "age") if c in segments]
+    ranked = segments[columns].where(segments[columns].isin(list(tables)))
+    keys, shared = {}, {}
+    for user_id, row in zip(ranked.index.tolist(), ranked.itertuples(index=False)):
+        found = tuple(key for key in row if isinstance(key, str))
+        if found:
+            # Few distinct combinations; share one tuple per combination
+            keys[user_id] = shared.setdefault(found, found)
+    return keys
+
+
+def encode_user_segments(keys, names):
+    """user_segment_keys as arrays: ids plus (n, 2) codes into names, -1 padded."""
+    position = {name: i for i, name in enumerate(names)}
+    codes = np.full((len(keys), 2), -1, dtype=np.int16)
+    for i, found in enumerate(keys.values()):
+        codes[i, :len(found)] = [position[key] for key in found]
+    return np.asarray(list(keys)), codes
+
+
+def decode_user_segments(user_ids, codes, names):
+    """Inverse of encode_user_segments."""
+    combos = {}
+    keys = {}
+    for user_id, row in zip(np.asarray(user_ids).tolist(), np.asarray(codes).tolist()):
+        row = tuple(row)
+        if row not in combos:
+            combos[row] = tuple(names[code] for code in row if code >= 0)
+        keys[user_id] = combos[row]
+    return keys
+
+
+def bayesian_scores(item_rows, ratings, n_items, prior_weight, prior):
+    """
+    Damped mean per item: (prior_weight * prior + sum) / (prior_weight + n).
+    `prior` is a scalar or a per-item array; items with few ratings stay
+    close to it instead of jumping to the top on one 10-star rating.
+    """
+    counts = np.bincount(item_rows, minlength=n_items)
+    sums = np.bincount(item_rows, weights=ratings, minlength=n_items)
+    return (prior_weight * prior + sums) / (prior_weight + counts), counts
+
+
+def _ranking(scores, counts, top_n):
+    rated = np.flatnonzero(counts)
+    order = rated[np.argsort(-scores[rated], kind="stable")[:top_n]]
+    return order.astype(np.int32), scores[order].astype(np.float32)
+
+
+def build_popularity_tables(ratings, users, item_index, n_items, top_n=1000,
+                            prior_weight=None, min_segment_ratings=1000,
+                            rating_col="book-rating"):
+    """
+    Precomputed popularity rankings: {segment: (item rows, scores)} with
+    the top_n items of each, best first.
+
+    The global ranking is a Bayesian average towards the global mean
+    rating; prior_weight defaults to the mean number of ratings per rated
+    item. Segment rankings (age bucket and country, from Users) shrink
+    towards each item's global score, so a small segment only reorders
+    the global ranking where it has evidence. Segments with fewer than
+    min_segment_ratings ratings are left out and fall back to the global
+    ranking. Book-Crossing stores implicit interactions as rating 0; only
+    explicit ratings count here.
+    """
+    ratings = ratings[ratings[rating_col] > 0]
+    rows = pd.Index(item_index).get_indexer(ratings["book_id"])
+    known = rows >= 0
+    rows = rows[known]
+    values = ratings[rating_col].to_numpy(dtype=np.float64)[known]
+    if len(rows) == 0:
+        return {GLOBAL_SEGMENT: (np.empty(0, np.int32), np.empty(0, np.float32))}
+
+    rated_items = np.count_nonzero(np.bincount(rows, minlength=n_items))
+    prior_weight = prior_weight or len(rows) / rated_items
+    global_scores, counts = bayesian_scores(rows, values, n_items, prior_weight, values.mean())
+    tables = {GLOBAL_SEGMENT: _ranking(global_scores, counts, top_n)}
+
+    if users is None or "user_id" not in ratings:
+        return tables
+    by_rating = user_segments(users).reindex(ratings["user_id"].to_numpy()[known])
+    for column in by_rating.columns:
+        codes, segments = pd.factorize(by_rating[column].to_numpy())
+        sizes = np.bincount(codes[codes >= 0], minlength=len(segments))
+        for code, segment in enumerate(segments):
+            if sizes[code] < min_segment_ratings:
+                continue
+            mask = codes == code
+            scores, seg_counts = bayesian_scores(rows[mask], values[mask], n_items,
+                                                 prior_weight, global_scores)
+            tables[segment] = _ranking(scores, seg_counts, top_n)
+    return tables
@@ -1,55 +1,573 @@
 # backend/recommender.py
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import joblib
+from scipy.sparse import csr_matrix
 from sklearn.decomposition import TruncatedSVD
 import numpy as np
 
+from popularity import GLOBAL_SEGMENT, build_popularity_tables, user_segment_keys
+
+# Peak bytes per (query, catalog item) cell in _score_block: the float32
+# score block, the float32 product assigned into it and top_k_rows' int64
+# argpartition result
+BATCH_BYTES_PER_CELL = 4 + 4 + 8
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first, via a partial sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def top_k_rows(scores, k):
+    """Row-wise top_k for a dense (n_rows, n_items) score block."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n and scores.flags.writeable:
+        # Negate in place rather than copy the block, and partition at the
+        # front: with kth near the end, argpartition degrades badly on the
+        # heavily tied (mostly zero) rows CF blocks have. Negation is exact,
+        # so flipping back restores the caller's scores.
+        np.negative(scores, out=scores)
+        try:
+            part = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        finally:
+            np.negative(scores, out=scores)
+    elif k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+def batch_block_rows(n_items, memory_mb=1024, n_threads=1):
+    """Queries per recommend_batch block so n_threads concurrent blocks stay within memory_mb in total."""
+    budget = memory_mb * 2 ** 20 // max(n_threads, 1)
+    return int(max(1, min(256, budget // (BATCH_BYTES_PER_CELL * max(n_items, 1)))))
+
+
+def _unit_rows(x):
+    # Last axis, so a single query vector works too (ann.IVFIndex)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+class ImplicitALS:
+    """
+    Alternating least squares for implicit feedback (Hu, Koren & Volinsky).
+    Every stored rating counts as an interaction, including Book-Crossing's
+    implicit 0s, with confidence 1 + alpha * (1 + rating / 10). Each
+    alternating step solves all rows with a few conjugate-gradient
+    iterations, warm-started from the previous factors. Rows are solved in
+    blocks on a thread pool; within a block every CG operation is a dense
+    matmul or a sparse-dense product, so the heavy lifting runs in BLAS
+    outside the GIL.
+    Mirrors the TruncatedSVD attributes Recommender relies on:
+    fit_transform returns user factors, components_ is (factors, n_items).
+    """
+
+    def __init__(self, factors=50, regularization=0.01, alpha=40.0, iterations=15,
+                 cg_steps=3, block_size=4096, n_threads=None, random_state=42):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.block_size = block_size
+        self.n_threads = n_threads
+        self.random_state = random_state
+        self.components_ = None
+
+    def _confidence_weights(self, X):
+        # alpha * (1 + r/10): the part of the confidence above 1
+        return self.alpha * (1.0 + X.data.astype(np.float32) / 10.0)
+
+    def fit_transform(self, X):
+        X = csr_matrix(X, dtype=np.float32)
+        Xt = X.T.tocsr()
+        rng = np.random.default_rng(self.random_state)
+        users = np.zeros((X.shape[0], self.factors), dtype=np.float32)
+        items = (rng.standard_normal((X.shape[1], self.factors)) * 0.01).astype(np.float32)
+        for _ in range(self.iterations):
+            users = self.solve(X, items, users)
+            items = self.solve(Xt, users, items)
+        self.components_ = items.T
+        return users
+
+    def transform(self, X):
+        X = csr_matrix(X, dtype=np.float32)
+        return self.solve(X, self.components_.T, np.zeros((X.shape[0], self.factors), dtype=np.float32))
+
+    def solve(self, X, fixed, init=None):
+        """Least-squares factors for every row of X given the other side's factors."""
+        X = csr_matrix(X, dtype=np.float32)
+        out = np.zeros((X.shape[0], fixed.shape[1]), dtype=np.float32) if init is None else init.copy()
+        gram = fixed.T.dot(fixed) + self.regularization * np.eye(fixed.shape[1], dtype=np.float32)
+        blocks = range(0, X.shape[0], self.block_size)
+
+        def run(start):
+            stop = min(start + self.block_size, X.shape[0])
+            out[start:stop] = self._cg_block(X[start:stop], fixed, gram, out[start:stop])
+
+        with ThreadPoolExecutor(max_workers=self.n_threads or os.cpu_count()) as pool:
+            list(pool.map(run, blocks))
+        return out
+
+    def _cg_block(self, block, fixed, gram, x):
+        """Batched conjugate gradient for (F^T C_u F + reg I) x_u = F^T C_u p_u."""
+        weights = self._confidence_weights(block)
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        gathered = fixed[block.indices]
+
+        def sparse(values):
+            return csr_matrix((values, block.indices, block.indptr), shape=block.shape)
+
+        def apply(p):
+            # A p = gram p + F^T (C_u - I) F p, one sparse-dense product per block
+            inner = np.einsum("ij,ij->i", gathered, p[rows])
+            return p.dot(gram) + sparse(weights * inner).dot(fixed)
+
+        b = sparse(1.0 + weights).dot(fixed)
+        r = b - apply(x)
+        p = r.copy()
+        rs = np.einsum("ij,ij->i", r, r)
+        for _ in range(self.cg_steps):
+            ap = apply(p)
+            denom = np.einsum("ij,ij->i", p, ap)
+            step = np.divide(rs, denom, out=np.zeros_like(rs), where=denom > 0)
+            x = x + step[:, None] * p
+            r = r - step[:, None] * ap
+            rs_new = np.einsum("ij,ij->i", r, r)
+            beta = np.divide(rs_new, rs, out=np.zeros_like(rs), where=rs > 0)
+            p = r + beta[:, None] * p
+            rs = rs_new
+        return x
+
+
 class Recommender:
-    def __init__(self, cf_components=50, hybrid_alpha=0.5):
+    def __init__(self, cf_components=50, hybrid_alpha=0.5, cf_engine="svd", als_params=None):
         self.cf_components = cf_components
         self.hybrid_alpha = hybrid_alpha
+        # "svd" (TruncatedSVD on raw ratings) or "als" (ImplicitALS)
+        self.cf_engine = cf_engine
+        self.als_params = als_params or {}
         self.cf_model = None
+        self.cf_item_vectors = None
         self.content_matrix = None
         self.item_ids = None
         self.tfidf = None
         self.popularity = None
+        # user_id -> segment keys with a ranking, for requests without a profile
+        self.user_segments = {}
+        self.item_index = {}
+        self.neighbor_idx = None
+        self.neighbor_scores = None
+        self.cf_index = None
+        self.user_index = {}
+        self.seen_indptr = None
+        self.seen_items = None
+
+    def fit_cf(self, user_item_matrix, user_ids=None):
+        if self.cf_engine == "als":
+            model = ImplicitALS(factors=self.cf_components, **self.als_params)
+        else:
+            model = TruncatedSVD(n_components=self.cf_components, random_state=42)
+        self.cf_matrix = model.fit_transform(user_item_matrix)
+        self.cf_model = model
+        self.cf_item_vectors = _unit_rows(self.item_factors).astype(np.float32)
+        self.cf_fit_nnz = user_item_matrix.nnz
+        if user_ids is not None:
+            self.user_index = {u: i for i, u in enumerate(np.asarray(user_ids).tolist())}
+        self.set_seen(user_item_matrix)
+
+    def set_seen(self, user_item_matrix):
+        """
+        Per-user already-rated items as CSR row slices of the user-item
+        matrix: seen_items holds every rated column as int32 and
+        seen_indptr the int64 start of each user's slice. Memory is
+        4 bytes per rating + 8 per user, so 100k users at Book-Crossing's
+        ~4 ratings per user take ~2.4 MB (1M ratings: ~4.8 MB), where a
+        dense bitset over a 270k-book catalog would take 3.4 GB.
+        """
+        X = user_item_matrix.tocsr()
+        self.seen_indptr = X.indptr.astype(np.int64)
+        self.seen_items = X.indices.astype(np.int32)
+
+    def seen_rows(self, user_id):
+        """Item rows already rated by user_id (empty for unknown users); O(1) slice."""
+        row = self.user_index.get(user_id) if user_id is not None else None
+        if row is None or self.seen_indptr is None or row + 1 >= len(self.seen_indptr):
+            return np.empty(0, dtype=np.int32)
+        return self.seen_items[self.seen_indptr[row]:self.seen_indptr[row + 1]]
+
+    def partial_fit_cf(self, user_item_matrix, user_rows=None, item_rows=None,
+                       new_item_ids=None, new_user_ids=None, drift_threshold=0.2):
+        """
+        Fold a batch of new ratings into the existing latent space instead
+        of refitting. user_item_matrix is the full updated matrix, laid out
+        as in fit_cf with new users/items appended (see
+        build_user_item_matrix(user_ids=..., item_ids=...)); user_rows and
+        item_rows are the existing rows/columns the batch touched.
+        Items are folded in as v = x^T (U S) S^-2 against the current user
+        factors, then users as u = x V against the updated items (with ALS,
+        both are least-squares solves against the other side). Once the
+        ratings added since the last full fit exceed drift_threshold of
+        that fit's ratings, a full fit_cf runs instead.
+        Returns "refit" or "fold_in".
+        """
+        X = user_item_matrix.tocsr()
+        drift = (X.nnz - self.cf_fit_nnz) / max(self.cf_fit_nnz, 1)
+        self.set_seen(X)
+        if new_user_ids is not None:
+            # New users are appended after every fitted row, whether or not
+            # the fitted rows have ids in user_index
+            start = self.cf_matrix.shape[0]
+            self.user_index.update((u, start + i) for i, u in enumerate(new_user_ids))
+        if drift > drift_threshold:
+            self.fit_cf(X)
+            if new_item_ids is not None:
+                self._extend_items(new_item_ids)
+            if self.cf_index is not None:
+                # A refit is a new latent basis; the old index can't be queried with it
+                self.build_cf_index(n_lists=self.cf_index.n_lists, n_probe=self.cf_index.n_probe)
+            return "refit"
+
+        n_users, n_items = self.cf_matrix.shape[0], self.cf_model.components_.shape[1]
+        users = np.union1d(np.asarray(user_rows if user_rows is not None else [], dtype=np.int64),
+                           np.arange(n_users, X.shape[0]))
+        items = np.union1d(np.asarray(item_rows if item_rows is not None else [], dtype=np.int64),
+                           np.arange(n_items, X.shape[1]))
 
-    def fit_cf(self, user_item_matrix):
-        svd = TruncatedSVD(n_components=self.cf_components, random_state=42)
-        self.cf_matrix = svd.fit_transform(user_item_matrix)
-        self.cf_model = svd
+        components = np.zeros((self.cf_model.components_.shape[0], X.shape[1]))
+        components[:, :n_items] = self.cf_model.components_
+        item_cols = X[:n_users].T.tocsr()[items]
+        als = isinstance(self.cf_model, ImplicitALS)
+        if als:
+            components[:, items] = self.cf_model.solve(item_cols, self.cf_matrix).T
+        else:
+            components[:, items] = (item_cols.dot(self.cf_matrix) / self.cf_model.singular_values_ ** 2).T
+        self.cf_model.components_ = components
+
+        cf_matrix = np.zeros((X.shape[0], self.cf_matrix.shape[1]))
+        cf_matrix[:n_users] = self.cf_matrix
+        if als:
+            cf_matrix[users] = self.cf_model.solve(X[users], components.T)
+        else:
+            cf_matrix[users] = X[users].dot(components.T)
+        self.cf_matrix = cf_matrix
+
+        self.cf_item_vectors = _unit_rows(self.item_factors).astype(np.float32)
+        if new_item_ids is not None:
+            self._extend_items(new_item_ids)
+        return "fold_in"
+
+    def _extend_items(self, new_item_ids):
+        # New items get empty content rows and no neighbours until the next
+        # content build; the ANN index picks them up when it is rebuilt.
+        from scipy.sparse import csr_matrix, vstack
+
+        start = len(self.item_ids)
+        self.item_ids.extend(new_item_ids)
+        self.item_index.update((b, start + i) for i, b in enumerate(new_item_ids))
+        n_new = len(new_item_ids)
+        if self.content_matrix is not None:
+            empty = csr_matrix((n_new, self.content_matrix.shape[1]), dtype=self.content_matrix.dtype)
+            self.content_matrix = vstack([self.content_matrix, empty]).tocsr()
+        if self.neighbor_idx is not None:
+            self.neighbor_idx = np.vstack([self.neighbor_idx, np.zeros((n_new, self.neighbor_idx.shape[1]), dtype=np.int32)])
+            self.neighbor_scores = np.vstack([self.neighbor_scores, np.zeros((n_new, self.neighbor_scores.shape[1]), dtype=np.float16)])
+
+    def recommend_batch(self, queries, k=10, block_size=None, n_threads=None, memory_mb=1024):
+        """
+        Score many queries together. queries is an iterable of
+        (user_id, liked_book_ids); known users are scored with their CF
+        factors, otherwise the mean of the liked items' CF vectors is used.
+        Queries are scored in blocks of block_size with one matrix product
+        per block against the item factors, blocks spread over a thread
+        pool. By default block_size is sized so the blocks being scored
+        at once fit memory_mb in total (batch_block_rows). Yields (query, recommendations) in input order; queries
+        that can't be scored get popularity.
+        """
+        n_threads = n_threads or os.cpu_count() or 1
+        item_factors = self.cf_model.components_.astype(np.float32)
+        block_size = block_size or batch_block_rows(item_factors.shape[1], memory_mb, n_threads)
+        pending = deque()
+
+        def blocks():
+            block = []
+            for query in queries:
+                block.append(query)
+                if len(block) == block_size:
+                    yield block
+                    block = []
+            if block:
+                yield block
+
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            for block in blocks():
+                pending.append(pool.submit(self._score_block, block, k, item_factors))
+                # Bounded window keeps memory flat however long the input is
+                if len(pending) > 2 * n_threads:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def _score_block(self, block, k, item_factors):
+        n_factors = item_factors.shape[0]
+        by_user = np.zeros((len(block), n_factors), dtype=np.float32)
+        by_items = np.zeros((len(block), n_factors), dtype=np.float32)
+        user_mask = np.zeros(len(block), dtype=bool)
+        item_mask = np.zeros(len(block), dtype=bool)
+        liked_rows = []
+        for i, (user_id, liked) in enumerate(block):
+            rows = self._rows_for(liked or [])
+            liked_rows.append(rows)
+            if user_id in self.user_index:
+                by_user[i] = self.cf_matrix[self.user_index[user_id]]
+                user_mask[i] = True
+            elif len(rows):
+                by_items[i] = self.cf_item_vectors[rows].mean(axis=0)
+                item_mask[i] = True
+
+        # Two products per block: raw user factors x item factors, and
+        # liked-item profiles x unit item vectors (cosine, as in recommend)
+        scores = np.full((len(block), item_factors.shape[1]), -np.inf, dtype=np.float32)
+        if user_mask.any():
+            scores[user_mask] = by_user[user_mask].dot(item_factors)
+        if item_mask.any():
+            scores[item_mask] = by_items[item_mask].dot(self.cf_item_vectors.T)
+        # Liked and already-rated items in one scatter: (block row, item) pairs
+        masked = [np.concatenate([rows, self.seen_rows(user_id)])
+                  for (user_id, _), rows in zip(block, liked_rows)]
+        lengths = [len(m) for m in masked]
+        if sum(lengths):
+            scores[np.repeat(np.arange(len(block)), lengths), np.concatenate(masked)] = -np.inf
+
+        top = top_k_rows(scores, k)
+        results = []
+        for i in range(len(block)):
+            if user_mask[i] or item_mask[i]:
+                recs = [
+                    {"book_id": self.item_ids[j], "score": float(scores[i, j])}
+                    for j in top[i] if np.isfinite(scores[i, j])
+                ]
+            else:
+                recs = self.recommend(k=k, use_popularity=True)
+            results.append((block[i], recs))
+        return results
+
+    def score_users(self, user_rows, item_factors=None):
+        """
+        Dense CF scores (len(user_rows), n_items) for rows of the fitted
+        matrix. Pass item_factors = components_.astype(np.float32) (made
+        once) to get a float32 block at half the memory.
+        """
+        if item_factors is None:
+            return self.cf_matrix[user_rows].dot(self.cf_model.components_)
+        return self.cf_matrix[user_rows].astype(item_factors.dtype).dot(item_factors)
+
+    @property
+    def item_factors(self):
+        # TruncatedSVD keeps item factors as (n_components, n_items)
+        return self.cf_model.components_.T
+
+    def build_cf_index(self, n_lists=256, n_probe=8):
+        from ann import IVFIndex
+
+        self.cf_index = IVFIndex(n_lists=n_lists, n_probe=n_probe).build(
+            self.item_factors, ids=self.item_ids
+        )
+        return self.cf_index
 
     def fit_content(self, content_matrix, item_ids, tfidf):
-        self.content_matrix = content_matrix
-        self.item_ids = item_ids
+        self.content_matrix = content_matrix.tocsr()
+        self.item_ids = list(item_ids)
         self.tfidf = tfidf
+        # id -> row hash index so lookups don't scan item_ids
+        self.item_index = {book_id: i for i, book_id in enumerate(self.item_ids)}
+
+    def fit_neighbors(self, top_n=50, block_size=None, n_jobs=None):
+        from neighbors import build_neighbor_table
 
-    def build_popularity(self, ratings_df, item_encoder, id_lookup):
-        counts = ratings_df.groupby("item_idx")["book-rating"].mean()
-        self.popularity = [
-            {"book_id": id_lookup(idx), "score": score}
-            for idx, score in counts.sort_values(ascending=False).items()
+        self.neighbor_idx, self.neighbor_scores = build_neighbor_table(
+            self.content_matrix, top_n=top_n, block_size=block_size, n_jobs=n_jobs
+        )
+
+    def build_popularity(self, ratings_df, users_df=None, top_n=1000, **kwargs):
+        """
+        Precompute damped popularity rankings (global + per user segment)
+        as item-row arrays; see popularity.build_popularity_tables. With
+        users_df, also which ranked segments each user belongs to.
+        """
+        self.popularity = build_popularity_tables(
+            ratings_df, users_df, self.item_ids, len(self.item_ids), top_n=top_n, **kwargs
+        )
+        if users_df is not None:
+            self.user_segments = user_segment_keys(users_df, self.popularity)
+
+    def popular(self, k=10, segments=(), seen=None):
+        """
+        Top-k of the first precomputed segment ranking available, skipping
+        `seen` item rows; O(k + len(seen)).
+        """
+        if not self.popularity:
+            return []
+        for segment in list(segments) + [GLOBAL_SEGMENT]:
+            if segment in self.popularity:
+                rows, scores = self.popularity[segment]
+                break
+        n = k if seen is None else k + len(seen)
+        rows, scores = rows[:n], scores[:n]
+        if seen is not None and len(seen):
+            keep = ~np.isin(rows, seen)
+            rows, scores = rows[keep][:k], scores[keep][:k]
+        return [
+            {"book_id": self.item_ids[row], "score": float(score)}
+            for row, score in zip(rows.tolist(), scores.tolist())
         ]
 
-    def recommend(self, liked_book_ids=None, k=10, use_popularity=False):
+    def recommend(self, liked_book_ids=None, k=10, use_popularity=False, segments=(), user_id=None,
+                  exclude_book_ids=None):
+        """
+        Top-k hybrid recommendations for the liked books. With a known
+        user_id, books that user already rated are masked out before the
+        top-k selection, as are exclude_book_ids and the liked books
+        themselves.
+        """
+        seen = self.seen_rows(user_id)
+        if exclude_book_ids:
+            seen = np.concatenate([seen, self._rows_for(exclude_book_ids)])
         if use_popularity or not liked_book_ids:
-            return self.popularity[:k]
+            if liked_book_ids:
+                seen = np.concatenate([seen, self._rows_for(liked_book_ids)])
+            return self.popular(k, segments, seen)
 
         # Hybrid scoring: CF + Content
-        scores = {}
-        for book_id in liked_book_ids:
-            if book_id not in self.item_ids:
-                continue
-            idx = self.item_ids.index(book_id)
-            sim_scores = self.content_matrix[idx].dot(self.content_matrix.T).toarray()[0]
-            for i, score in enumerate(sim_scores):
-                scores[self.item_ids[i]] = scores.get(self.item_ids[i], 0) + score
-
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        return [{"book_id": b, "score": s} for b, s in ranked[:k]]
+        rows = self._rows_for(liked_book_ids)
+        if len(rows) == 0:
+            return []
+
+        items, scores = self._hybrid_scores(rows)
+        # Liked rows as well, like the pipeline and recommend_batch
+        seen = np.concatenate([seen, rows])
+        if len(items) == len(self.item_ids):
+            scores[seen] = -np.inf
+        else:
+            scores[np.isin(items, seen)] = -np.inf
+        top = top_k(scores, k)
+        return [
+            {"book_id": self.item_ids[items[i]], "score": float(scores[i])}
+            for i in top if np.isfinite(scores[i])
+        ]
+
+    def _hybrid_scores(self, rows, profile=None):
+        """
+        Blend of mean CF and mean content similarity to the liked rows:
+        hybrid_alpha * cf + (1 - hybrid_alpha) * content.
+        Returns (item rows, scores); with a neighbour table only the
+        neighbour/ANN candidates are scored, otherwise the whole catalog.
+        profile is self.profile(rows) when the caller already has it.
+        """
+        if self.neighbor_idx is not None:
+            items, content = self._content_from_neighbors(rows)
+            if self.cf_index is not None:
+                query = self.cf_item_vectors[rows].mean(axis=0)
+                cf_items, _ = self.cf_index.search(query, k=len(items), exclude=rows)
+                extra = np.setdiff1d(cf_items, items)
+                items = np.concatenate([items, extra])
+                content = np.concatenate([content, np.zeros(len(extra))])
+        else:
+            # Summing the liked rows first turns all liked-item similarities
+            # into a single sparse mat-vec against the catalog
+            items = np.arange(self.content_matrix.shape[0])
+            if profile is None:
+                profile = self.profile(rows)
+            content = self._content_scores(items, profile[1], len(rows))
+
+        return items, self._blend(rows, items, content, profile)
+
+    def score_candidates(self, rows, items, profile=None):
+        """
+        Full hybrid score of the liked rows against a candidate set only:
+        one sparse product over the candidates' content rows plus one CF
+        mat-vec, so the cost follows len(items), not the catalog size.
+        """
+        if profile is None:
+            profile = self.profile(rows)
+        content = self._content_scores(items, profile[1], len(rows))
+        return self._blend(rows, items, content, profile)
+
+    def profile(self, rows):
+        """
+        (CF sum, content sum) of the liked rows: the summed CF item vectors
+        (None without CF) and the summed content rows as a sparse 1 x
+        n_features row. Everything scoring needs from the liked side; being
+        sums, they can be kept up to date by adding and subtracting rows
+        (cache.UserProfileCache).
+        """
+        cf = None
+        if self.cf_model is not None:
+            cf = self.cf_item_vectors[rows].sum(axis=0, dtype=np.float64)
+        block = self.content_matrix[rows]
+        content = csr_matrix((block.data.astype(np.float64), block.indices, [0, block.nnz]),
+                             shape=(1, block.shape[1]))
+        content.sum_duplicates()
+        return cf, content
+
+    def _content_scores(self, items, content_profile, n_liked):
+        if len(items) == self.content_matrix.shape[0]:
+            matrix = self.content_matrix
+        else:
+            matrix = self.content_matrix[items]
+        # Stored sparse; a dense vector makes the mat-vec itself cheaper
+        return matrix.dot(content_profile.toarray().ravel()) / n_liked
+
+    def _blend(self, rows, items, content, profile=None):
+        if self.cf_model is None:
+            return content
+        if profile is None:
+            query = self.cf_item_vectors[rows].mean(axis=0)
+        else:
+            query = profile[0] / len(rows)
+        cf = self.cf_item_vectors[items].dot(query)
+        return self.hybrid_alpha * cf + (1 - self.hybrid_alpha) * content
+
+    def _content_from_neighbors(self, rows):
+        # Only len(rows) * top_n precomputed entries are touched; liked items
+        # themselves never appear since the table excludes self-similarity.
+        nbrs = self.neighbor_idx[rows].ravel()
+        sims = self.neighbor_scores[rows].ravel().astype(np.float32)
+        items, inverse = np.unique(nbrs, return_inverse=True)
+        return items, np.bincount(inverse, weights=sims) / len(rows)
+
+    def _rows_for(self, book_ids):
+        rows = [self.item_index[b] for b in book_ids if b in self.item_index]
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
 
     def save(self, path):
-        joblib.dump(self, f"{path}.pkl")
+        """Save as an mmap-able array bundle in the directory `path` (artifacts.py)."""
+        from artifacts import save_bundle
+
+        save_bundle(self, path)
 
     @staticmethod
-    def load(path):
+    def load(path, mmap=True):
+        """Load an array bundle (memory-mapped by default) or a legacy `{path}.pkl`."""
+        from artifacts import MANIFEST, load_bundle
+
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            return load_bundle(path, mmap=mmap)
         return joblib.load(f"{path}.pkl")
@@ -0,0 +1,206 @@
+# backend/search_index.py
+
+import re
+from bisect import bisect_left
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+TOKEN_RE = re.compile(r"\w+")
+# Prefixes up to this length get precomputed posting lists, so the first
+# keystrokes of a typeahead query don't union thousands of tokens; as a
+# whole query, they are answered from lists kept in rank order.
+PREFIX_CACHE_LEN = 2
+TITLE_WEIGHT = 2.0
+AUTHOR_WEIGHT = 1.0
+EXACT_BONUS = 0.5
+EMPTY = np.empty(0, dtype=np.int32)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _prefixes(tokens):
+    return {tok[:n] for n in range(1, PREFIX_CACHE_LEN + 1) for tok in tokens}
+
+
+def _postings(keys_per_row):
+    """{key: sorted unique int32 rows} from one list of keys per row."""
+    lengths = np.fromiter(map(len, keys_per_row), dtype=np.int64, count=len(keys_per_row))
+    rows = np.repeat(np.arange(len(keys_per_row), dtype=np.int32), lengths)
+    flat = np.fromiter(chain.from_iterable(keys_per_row), dtype=object, count=int(lengths.sum()))
+    key_ids, keys = pd.factorize(flat)
+
+    # One sort for all keys; every posting list is a view into `rows`
+    order = np.lexsort((rows, key_ids))
+    key_ids, rows = key_ids[order], rows[order]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[1:] = (key_ids[1:] != key_ids[:-1]) | (rows[1:] != rows[:-1])
+    key_ids, rows = key_ids[keep], rows[keep]
+    bounds = np.searchsorted(key_ids, np.arange(len(keys) + 1))
+    return {key: rows[bounds[i]:bounds[i + 1]] for i, key in enumerate(keys.tolist())}
+
+
+def _union(arrays, n_rows):
+    """Sorted union of sorted row arrays."""
+    if not arrays:
+        return EMPTY
+    if len(arrays) == 1:
+        return arrays[0]
+    if sum(map(len, arrays)) < 1024:
+        return np.unique(np.concatenate(arrays))
+    # Large unions: one pass over a row mask instead of hashing/sorting them
+    mask = np.zeros(n_rows, dtype=bool)
+    for rows in arrays:
+        mask[rows] = True
+    return np.flatnonzero(mask).astype(np.int32)
+
+
+def _member(candidates, rows, n_rows):
+    """Boolean mask of which sorted candidates appear in sorted rows."""
+    if not len(rows):
+        return np.zeros(len(candidates), dtype=bool)
+    if len(candidates) * 16 < n_rows:
+        # Few candidates: binary searches beat touching every row
+        pos = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+        return rows[pos] == candidates
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[rows] = True
+    return mask[candidates]
+
+
+class BookSearchIndex:
+    """
+    Token/prefix inverted index over book titles and authors.
+    Every query token must match a title or author token; the last token
+    is matched as a prefix so partially typed words work. When nothing
+    matches, an optional trigram index answers plain substring queries.
+    """
+
+    def __init__(self, titles, authors, trigrams=False):
+        self.titles = np.asarray(titles, dtype=object)
+        self.authors = np.asarray(authors, dtype=object)
+        self.n_rows = len(self.titles)
+
+        title_tokens = [tokenize(t) for t in self.titles]
+        author_tokens = [tokenize(a) for a in self.authors]
+        self.title_postings = _postings(title_tokens)
+        self.author_postings = _postings(author_tokens)
+        self.vocab = sorted(set(self.title_postings) | set(self.author_postings))
+        self.title_prefixes = _postings([_prefixes(toks) for toks in title_tokens])
+        self.author_prefixes = _postings([_prefixes(toks) for toks in author_tokens])
+        # Title length is the tie-breaker: shorter titles are closer matches
+        self.title_len = np.array([len(t) for t in title_tokens], dtype=np.int32)
+        # The broadest queries, a lone first keystroke or two, are the most
+        # common typeahead requests: rank them once so a page is a slice
+        self.prefix_ranked = {}
+        for prefix in set(self.title_prefixes) | set(self.author_prefixes):
+            match = self._match(prefix, True)
+            rows = _union(list(match), self.n_rows)
+            self.prefix_ranked[prefix] = rows[np.argsort(self._rank_keys([prefix], [match], rows), kind="stable")]
+
+        self.trigram_postings = None
+        if trigrams:
+            # newline keeps a substring from spanning title and author
+            self.lowered = [f"{t}\n{a}".lower() for t, a in zip(self.titles, self.authors)]
+            self.trigram_postings = _postings([_trigrams(text) for text in self.lowered])
+
+    def _prefix_tokens(self, prefix):
+        lo = bisect_left(self.vocab, prefix)
+        hi = bisect_left(self.vocab, prefix + "\uffff")
+        return self.vocab[lo:hi]
+
+    def _rows(self, postings, tokens):
+        return _union([postings[t] for t in tokens if t in postings], self.n_rows)
+
+    def _match(self, token, is_prefix):
+        """(rows matching in the title, rows matching in the author) for one query token."""
+        if is_prefix and len(token) <= PREFIX_CACHE_LEN:
+            title = self.title_prefixes.get(token, EMPTY)
+            author = self.author_prefixes.get(token, EMPTY)
+        else:
+            tokens = self._prefix_tokens(token) if is_prefix else [token]
+            title = self._rows(self.title_postings, tokens)
+            author = self._rows(self.author_postings, tokens)
+        return title, author
+
+    def search(self, query, limit=20, offset=0):
+        """Row indices of the ranked matches for query[offset:offset + limit]."""
+        tokens = tokenize(query)
+        if not tokens:
+            if query.strip():
+                return self._substring_search(query, limit, offset)
+            return np.arange(offset, min(offset + limit, self.n_rows))
+
+        if len(tokens) == 1 and tokens[0] in self.prefix_ranked:
+            return self.prefix_ranked[tokens[0]][offset:offset + limit]
+
+        matches = [self._match(tok, i == len(tokens) - 1) for i, tok in enumerate(tokens)]
+        # Intersect smallest posting lists first
+        candidates = None
+        for title, author in sorted(matches, key=lambda m: len(m[0]) + len(m[1])):
+            if candidates is None:
+                candidates = _union([title, author], self.n_rows)
+            else:
+                # Broad tokens' lists are never unioned, only probed
+                candidates = candidates[_member(candidates, title, self.n_rows) |
+                                        _member(candidates, author, self.n_rows)]
+            if len(candidates) == 0:
+                return self._substring_search(query, limit, offset)
+
+        key = self._rank_keys(tokens, matches, candidates)
+        page = offset + limit
+        if page < len(key):
+            top = np.argpartition(key, page - 1)[:page]
+            key, candidates = key[top], candidates[top]
+        order = np.argsort(key, kind="stable")
+        return candidates[order[offset:page]]
+
+    def _rank_keys(self, tokens, matches, candidates):
+        """
+        Sort keys of the candidates: (score desc, title length asc, row asc)
+        packed into one integer, so only the requested page needs a full sort.
+        """
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        for i, ((title_rows, _), tok) in enumerate(zip(matches, tokens)):
+            in_title = _member(candidates, title_rows, self.n_rows)
+            scores += np.where(in_title, TITLE_WEIGHT, AUTHOR_WEIGHT)
+            if i < len(tokens) - 1:
+                # Whole (non-last) tokens only match exactly
+                scores += EXACT_BONUS
+            else:
+                exact = _member(candidates, self.title_postings.get(tok, EMPTY), self.n_rows) | \
+                    _member(candidates, self.author_postings.get(tok, EMPTY), self.n_rows)
+                scores += EXACT_BONUS * exact
+
+        title_len = self.title_len[candidates].astype(np.int64)
+        key = -np.round(scores / EXACT_BONUS).astype(np.int64)
+        return (key * (self.title_len.max() + 1) + title_len) * self.n_rows + candidates
+
+    def _substring_search(self, query, limit, offset):
+        needle = query.strip().lower()
+        if self.trigram_postings is None or len(needle) < 3:
+            return EMPTY
+
+        grams = sorted(_trigrams(needle), key=lambda g: len(self.trigram_postings.get(g, ())))
+        candidates = None
+        for gram in grams:
+            rows = self.trigram_postings.get(gram)
+            if rows is None:
+                return EMPTY
+            candidates = rows if candidates is None else candidates[_member(candidates, rows, self.n_rows)]
+
+        # Trigrams over-approximate; verify only as many rows as the page needs
+        hits = []
+        for row in candidates.tolist():
+            if needle in self.lowered[row]:
+                hits.append(row)
+                if len(hits) >= offset + limit:
+                    break
+        return np.array(hits[offset:], dtype=np.int32)
@@ -0,0 +1,123 @@
+# backend/serving.py
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LatencyBudget:
+    """
+    Predicts how long hybrid scoring will take from recent requests and
+    tells the caller to serve popularity instead when the estimate would
+    overrun the deadline. Cost is tracked as an exponentially weighted
+    average of milliseconds per liked book. While falling back, every
+    probe_every-th request is still scored so the estimate can recover.
+    """
+
+    def __init__(self, deadline_ms=0.0, smoothing=0.2, probe_every=50):
+        self.deadline_ms = deadline_ms
+        self.smoothing = smoothing
+        self.probe_every = probe_every
+        self.ms_per_item = 0.0
+        self.skipped = 0
+
+    def allows(self, n_items):
+        if self.deadline_ms <= 0 or self.ms_per_item * n_items <= self.deadline_ms:
+            return True
+        self.skipped += 1
+        if self.skipped % self.probe_every == 0:
+            return True
+        return False
+
+    def record(self, n_items, elapsed_ms):
+        sample = elapsed_ms / max(n_items, 1)
+        if self.ms_per_item == 0.0:
+            self.ms_per_item = sample
+        else:
+            self.ms_per_item += self.smoothing * (sample - self.ms_per_item)
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing work once the executor's queue-depth limit is hit."""
+
+
+class BoundedExecutor:
+    """
+    Thread pool for CPU-bound request work with a hard limit on queued +
+    running jobs. Past max_pending, run() fails fast with Overloaded so the
+    caller can answer 503 instead of letting latency pile up in a queue.
+    NumPy/SciPy release the GIL in the heavy kernels, so threads overlap
+    the scoring work while the event loop stays free.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.max_workers
+        self.pending = 0
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="score")
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a slot or raise Overloaded; pair with release()."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded()
+            self.pending += 1
+
+    def release(self):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, fn, *args):
+        self.reserve()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.max_workers, "max_pending": self.max_pending,
+                    "pending": self.pending, "rejected": self.rejected}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event and any `fields` extra."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestLog:
+    """
+    Sampled per-request logging: a sample_rate fraction of requests is
+    logged, plus every request slower than slow_ms. Each line carries its
+    sample_rate so counts can be scaled back up.
+    """
+
+    def __init__(self, logger, sample_rate=0.01, slow_ms=250.0):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    def log(self, event, elapsed_ms, **fields):
+        slow = elapsed_ms >= self.slow_ms
+        if not slow and random.random() >= self.sample_rate:
+            return
+        fields.update(elapsed_ms=round(elapsed_ms, 3), sample_rate=1.0 if slow else self.sample_rate)
+        self.logger.info(event, extra={"fields": fields})
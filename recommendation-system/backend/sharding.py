@@ -0,0 +1,242 @@
+# backend/sharding.py
+
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.decomposition import TruncatedSVD
+
+from popularity import GLOBAL_SEGMENT, decode_user_segments, encode_user_segments
+from recommender import Recommender, top_k
+
+MANIFEST = "shards.json"
+
+# Set once per shard process by _init_shard: the shard's slice of the catalog
+_SHARD = {}
+
+
+def split_model(rec, n_shards, out_dir):
+    """
+    Partition a fitted Recommender's item side into n_shards contiguous
+    row ranges, each saved as its own (memory-mappable) model bundle with
+    the rows' content vectors, CF item vectors and ids. What the
+    coordinator needs without touching items (per-user seen slices in
+    global rows, popularity rankings as ids, blend weight) goes into
+    shards.json plus a few arrays next to the shard directories.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    n_items = len(rec.item_ids)
+    bounds = np.linspace(0, n_items, n_shards + 1).astype(int)
+    shards = []
+    for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        part = Recommender(cf_components=rec.cf_components, hybrid_alpha=rec.hybrid_alpha)
+        part.fit_content(rec.content_matrix[start:stop], rec.item_ids[start:stop], None)
+        if rec.cf_model is not None:
+            # Only item vectors are needed to score; user factors stay out
+            part.cf_model = TruncatedSVD(n_components=rec.cf_model.components_.shape[0])
+            part.cf_model.components_ = np.asarray(rec.cf_model.components_[:, start:stop])
+            part.cf_model.singular_values_ = np.ones(part.cf_model.components_.shape[0])
+            part.cf_matrix = np.empty((0, part.cf_model.components_.shape[0]), dtype=np.float32)
+            part.cf_item_vectors = np.asarray(rec.cf_item_vectors[start:stop])
+        name = f"shard-{i:03d}"
+        part.save(os.path.join(out_dir, name))
+        shards.append({"path": name, "start": int(start), "stop": int(stop)})
+
+    popularity = {}
+    for segment, (rows, scores) in (rec.popularity or {}).items():
+        popularity[segment] = {"rows": rows.tolist(),
+                               "ids": [rec.item_ids[r] for r in rows.tolist()],
+                               "scores": np.asarray(scores).tolist()}
+    if rec.seen_indptr is not None:
+        np.save(os.path.join(out_dir, "seen_indptr.npy"), rec.seen_indptr)
+        np.save(os.path.join(out_dir, "seen_items.npy"), rec.seen_items)
+        np.save(os.path.join(out_dir, "user_ids.npy"), np.asarray(list(rec.user_index)))
+    if rec.user_segments and popularity:
+        user_ids, codes = encode_user_segments(rec.user_segments, list(popularity))
+        np.save(os.path.join(out_dir, "segment_user_ids.npy"), user_ids)
+        np.save(os.path.join(out_dir, "segment_codes.npy"), codes)
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump({"n_items": n_items, "n_features": rec.content_matrix.shape[1],
+                   "hybrid_alpha": rec.hybrid_alpha,
+                   "has_cf": rec.cf_model is not None, "shards": shards,
+                   "popularity": popularity}, f)
+    return out_dir
+
+
+# --- Shard worker side -------------------------------------------------------
+
+def _init_shard(path, start):
+    _SHARD["rec"] = Recommender.load(path)
+    _SHARD["start"] = start
+
+
+def _shard_size():
+    return len(_SHARD["rec"].item_ids)
+
+
+def _shard_profile(book_ids):
+    """This shard's share of the query: content rows of the liked books it owns and their CF sum."""
+    rec = _SHARD["rec"]
+    rows = rec._rows_for(book_ids)
+    block = rec.content_matrix[rows]
+    cf = rec.cf_item_vectors[rows].sum(axis=0) if rec.cf_item_vectors is not None and len(rows) else None
+    return len(rows), block.indices, block.data, cf
+
+
+def _shard_top_k(profile, cf_query, n_liked, alpha, k, exclude_ids, exclude_rows):
+    """Hybrid scores of every item in the shard against the merged query; local top-k ids, scores and content rows."""
+    rec, start = _SHARD["rec"], _SHARD["start"]
+    scores = np.asarray(rec.content_matrix.dot(profile.T).todense()).ravel() / n_liked
+    if cf_query is not None:
+        scores = alpha * rec.cf_item_vectors.dot(cf_query) + (1 - alpha) * scores
+
+    n = len(scores)
+    local = exclude_rows[(exclude_rows >= start) & (exclude_rows < start + n)] - start
+    scores[local] = -np.inf
+    scores[rec._rows_for(exclude_ids)] = -np.inf
+    top = top_k(scores, k)
+    top = top[np.isfinite(scores[top])]
+    return [rec.item_ids[i] for i in top.tolist()], scores[top], rec.content_matrix[top]
+
+
+# --- Coordinator -------------------------------------------------------------
+
+class _Candidates:
+    """
+    Merged shard candidates posing as a model for a pipeline diversity
+    step, fn(model, items, scores, k): item_ids and content_matrix cover
+    only these rows, so items are 0..n-1.
+    """
+
+    def __init__(self, item_ids, content_matrix):
+        self.item_ids = item_ids
+        self.content_matrix = content_matrix
+
+
+class ShardedRecommender:
+    """
+    Scatter-gather front for a model split by split_model. Each shard is
+    served by its own single-process pool holding only that slice of the
+    catalog. A request takes two rounds: every shard returns its part of
+    the liked-book profile, then every shard scores its items against the
+    merged profile and returns a local top-k, which are merged here.
+    Scores match Recommender.recommend's full-catalog hybrid score. With a
+    diversity step, shards also return their candidates' content rows and
+    the merged pool is re-ranked like the pipeline's.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.hybrid_alpha = manifest["hybrid_alpha"]
+        self.has_cf = manifest["has_cf"]
+        self.n_features = manifest["n_features"]
+        self.popularity = manifest["popularity"]
+        # spawn: shard processes must not inherit a forked copy of the server
+        context = get_context("spawn")
+        self.shards = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_shard,
+                                initargs=(os.path.join(path, s["path"]), s["start"]))
+            for s in manifest["shards"]
+        ]
+        # Start every shard now so the first request doesn't pay for the loads
+        sizes = [f.result() for f in [shard.submit(_shard_size) for shard in self.shards]]
+        assert sizes == [s["stop"] - s["start"] for s in manifest["shards"]]
+        self.user_index = {}
+        self.seen_indptr = self.seen_items = None
+        if os.path.exists(os.path.join(path, "seen_indptr.npy")):
+            self.seen_indptr = np.load(os.path.join(path, "seen_indptr.npy"), mmap_mode="r")
+            self.seen_items = np.load(os.path.join(path, "seen_items.npy"), mmap_mode="r")
+            user_ids = np.load(os.path.join(path, "user_ids.npy")).tolist()
+            self.user_index = {u: i for i, u in enumerate(user_ids)}
+        self.user_segments = {}
+        if os.path.exists(os.path.join(path, "segment_user_ids.npy")):
+            self.user_segments = decode_user_segments(np.load(os.path.join(path, "segment_user_ids.npy")),
+                                                      np.load(os.path.join(path, "segment_codes.npy")),
+                                                      list(self.popularity))
+
+    def seen_rows(self, user_id):
+        row = self.user_index.get(user_id) if user_id is not None else None
+        if row is None:
+            return np.empty(0, dtype=np.int32)
+        return np.asarray(self.seen_items[self.seen_indptr[row]:self.seen_indptr[row + 1]])
+
+    def popular(self, k=10, segments=(), exclude=(), seen=()):
+        """Top-k of the first stored segment ranking, skipping excluded ids and seen rows."""
+        for segment in list(segments) + [GLOBAL_SEGMENT]:
+            if segment in self.popularity:
+                ranking = self.popularity[segment]
+                break
+        else:
+            return []
+        excluded, seen = set(exclude), set(np.asarray(seen).tolist())
+        recs = []
+        for row, book_id, score in zip(ranking["rows"], ranking["ids"], ranking["scores"]):
+            if book_id not in excluded and row not in seen:
+                recs.append({"book_id": book_id, "score": score})
+                if len(recs) == k:
+                    break
+        return recs
+
+    def recommend(self, liked_book_ids=None, k=10, use_popularity=False, segments=(),
+                  user_id=None, exclude_book_ids=None, diversity=None, pool=5):
+        """
+        Top-k merged over all shards. With diversity (e.g. pipeline.MMR),
+        every shard sends its top pool * k and diversity(candidates, items,
+        scores, k) picks the final k from the merged best pool * k.
+        """
+        exclude_ids = list(exclude_book_ids or [])
+        seen = self.seen_rows(user_id)
+        if use_popularity or not liked_book_ids:
+            return self.popular(k, segments, exclude_ids + list(liked_book_ids or []), seen)
+
+        parts = [f.result() for f in [s.submit(_shard_profile, liked_book_ids) for s in self.shards]]
+        n_liked = sum(p[0] for p in parts)
+        if n_liked == 0:
+            return []
+        profile = csr_matrix(
+            (np.concatenate([p[2] for p in parts]), np.concatenate([p[1] for p in parts]),
+             [0, sum(len(p[1]) for p in parts)]),
+            shape=(1, self.n_features),
+        )
+        profile.sum_duplicates()
+        cf_query = None
+        if self.has_cf:
+            cf_query = sum(p[3] for p in parts if p[3] is not None) / n_liked
+
+        exclude_ids += list(liked_book_ids)
+        n = k if diversity is None else pool * k
+        futures = [s.submit(_shard_top_k, profile, cf_query, n_liked, self.hybrid_alpha, n,
+                            exclude_ids, seen) for s in self.shards]
+        ids, scores, blocks = [], [], []
+        for future in futures:
+            shard_ids, shard_scores, shard_block = future.result()
+            ids.extend(shard_ids)
+            scores.append(shard_scores)
+            blocks.append(shard_block)
+        scores = np.concatenate(scores)
+        top = top_k(scores, n)
+        if diversity is not None and len(top):
+            candidates = _Candidates([ids[i] for i in top.tolist()], vstack(blocks).tocsr()[top])
+            top = top[diversity(candidates, np.arange(len(top)), scores[top], k)]
+        return [{"book_id": ids[i], "score": float(scores[i])} for i in top[:k].tolist()]
+
+    def close(self):
+        for shard in self.shards:
+            shard.shutdown()
+
+
+if __name__ == "__main__":
+    # Offline step: python sharding.py models/recommender models/shards 4
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "models/recommender"
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else "models/shards"
+    n_shards = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    rec = Recommender.load(model_path)
+    print(f"⚙️ Splitting {len(rec.item_ids)} items into {n_shards} shards...")
+    split_model(rec, n_shards, out_dir)
+    print(f"✅ Shards written to {out_dir}")
@@ -1,25 +1,260 @@
 # backend/train.py
-import pandas as pd
-import numpy as np
-import pickle
+import argparse
+import hashlib
+import json
 import os
+import resource
+import shutil
+import time
+from functools import partial
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import model_store
+from ann import IVFIndex
+from catalog_store import fresh_store
+from data_processing import build_content_index, clean_ids, encode_ratings, load_raw_data, ratings_to_csr
+from neighbors import build_neighbor_table
+from popularity import build_popularity_tables, user_segment_keys
+from recommender import Recommender
+
+# Bump when a stage's code changes in a way that invalidates cached outputs
+CACHE_VERSION = 1
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_hash(csv_path):
+    """
+    Content hash of what load_raw_data reads for a CSV: its columnar store
+    (manifest plus arrays) when that is up to date, else the CSV itself.
+    """
+    store = fresh_store(csv_path)
+    if store is None:
+        return file_hash(csv_path)
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(store)):
+        digest.update(name.encode())
+        digest.update(file_hash(os.path.join(store, name)).encode())
+    return digest.hexdigest()
+
+
+def _rss_mb():
+    """Current resident set size in MB (Linux), None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StagePipeline:
+    """
+    Stages are fn(*dependency outputs, **params). A stage's cache key hashes
+    its name, params and its dependencies' keys (input files are keyed by
+    the content hash of what is read, see input_hash), so a rerun reuses every stage whose inputs are unchanged
+    and only loads the cached outputs that are actually needed.
+    """
+
+    def __init__(self, cache_dir, force=False):
+        self.cache_dir = cache_dir
+        self.force = force
+        self.stages = {}
+        self.inputs = {}
+        self.report = []
+        self._keys = {}
+        self._values = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def add_input(self, name, path):
+        self.inputs[name] = path
+
+    def add_stage(self, name, fn, deps=(), cache=True, **params):
+        self.stages[name] = (fn, list(deps), params, cache)
+
+    def key(self, name):
+        if name not in self._keys:
+            if name in self.inputs:
+                parts = ["file", input_hash(self.inputs[name])]
+            else:
+                _, deps, params, _ = self.stages[name]
+                parts = [name, CACHE_VERSION, json.dumps(params, sort_keys=True, default=str)]
+                parts += [self.key(dep) for dep in deps]
+            self._keys[name] = hashlib.sha256(json.dumps(parts).encode()).hexdigest()[:16]
+        return self._keys[name]
+
+    def get(self, name):
+        if name in self.inputs:
+            return self.inputs[name]
+        if name in self._values:
+            return self._values[name]
+
+        fn, deps, params, cache = self.stages[name]
+        path = os.path.join(self.cache_dir, f"{name}-{self.key(name)}.joblib")
+        if cache and not self.force and os.path.exists(path):
+            start = time.perf_counter()
+            value = joblib.load(path)
+            status = "cached"
+        else:
+            args = [self.get(dep) for dep in deps]
+            start = time.perf_counter()
+            value = fn(*args, **params)
+            if cache:
+                joblib.dump(value, path)
+            status = "computed"
+
+        elapsed = time.perf_counter() - start
+        rss, peak = _rss_mb(), _peak_rss_mb()
+        self.report.append({"stage": name, "status": status, "seconds": round(elapsed, 3),
+                            "rss_mb": rss and round(rss, 1), "peak_rss_mb": round(peak, 1)})
+        rss_text = f"rss {rss:.0f} MB, " if rss is not None else ""
+        print(f"⏱️ {name:<12} {elapsed:8.2f}s  {rss_text}peak {peak:.0f} MB  [{status}]")
+        self._values[name] = value
+        return value
+
+
+# --- Stages ----------------------------------------------------------------
+
+def load(ratings_csv, books_csv, users_csv):
+    return load_raw_data(ratings_csv, books_csv, users_csv)
+
+
+def clean(raw, min_rating=0, max_rating=10):
+    """
+    Drop unusable rows: missing or duplicate ids, non-numeric ratings and
+    ratings of books missing from Books (they'd have no content row).
+    A user's last rating of a book wins.
+    """
+    ratings, books, users = raw
+
+    books = books.loc[books["book_id"].notna()].copy()
+    books["book_id"] = clean_ids(books["book_id"])
+    books = books.drop_duplicates("book_id").reset_index(drop=True)
+
+    ratings = ratings.loc[ratings["user_id"].notna() & ratings["book_id"].notna()].copy()
+    ratings["book_id"] = clean_ids(ratings["book_id"])
+    ratings["book-rating"] = pd.to_numeric(ratings["book-rating"].astype(object), errors="coerce")
+    ratings = ratings[ratings["book-rating"].between(min_rating, max_rating)]
+    ratings = ratings[ratings["book_id"].isin(books["book_id"])]
+    ratings = ratings.drop_duplicates(["user_id", "book_id"], keep="last").reset_index(drop=True)
+
+    users = users.drop_duplicates("user_id").reset_index(drop=True)
+    return ratings, books, users
+
+
+def encode(cleaned):
+    # Columns follow the cleaned Books order, so CF and content rows line up
+    ratings, books, _ = cleaned
+    return encode_ratings(ratings, item_ids=books["book_id"].to_numpy())
+
+
+def fit_cf(matrix, encoded, cf_components=50, cf_engine="svd"):
+    rec = Recommender(cf_components=cf_components, cf_engine=cf_engine)
+    rec.fit_cf(matrix, user_ids=encoded["user_ids"])
+    return rec
+
+
+def content(cleaned):
+    _, books, _ = cleaned
+    matrix, tfidf = build_content_index(books)
+    return matrix.astype(np.float32), books["book_id"].tolist(), tfidf
+
+
+def neighbours(content_index, top_n=50, n_jobs=None):
+    matrix, _, _ = content_index
+    return build_neighbor_table(matrix, top_n=top_n, n_jobs=n_jobs)
+
+
+def popularity(cleaned, top_n=1000):
+    ratings, books, users = cleaned
+    return build_popularity_tables(ratings, users, books["book_id"].to_numpy(), len(books), top_n=top_n)
+
+
+def segments(cleaned, popularity_tables):
+    _, _, users = cleaned
+    return user_segment_keys(users, popularity_tables)
+
+
+def ann_index(rec, encoded, n_lists=256, n_probe=8):
+    # Only the CF factors go in; ids are the encoded columns (Books order)
+    ids = np.asarray(encoded["item_ids"]).tolist()
+    return IVFIndex(n_lists=n_lists, n_probe=n_probe).build(rec.item_factors, ids=ids)
+
+
+def assemble(rec, content_index, neighbour_table, popularity_tables, user_segments):
+    rec.fit_content(*content_index)
+    rec.neighbor_idx, rec.neighbor_scores = neighbour_table
+    rec.popularity = popularity_tables
+    rec.user_segments = user_segments
+    return rec
+
 
-DATA_PATH = "data/books.csv"
-MODEL_DIR = "models"
-MODEL_PATH = os.path.join(MODEL_DIR, "cf_matrix.pkl")
+def build_pipeline(args):
+    pipe = StagePipeline(args.cache_dir, force=args.force)
+    pipe.add_input("ratings_csv", args.ratings)
+    pipe.add_input("books_csv", args.books)
+    pipe.add_input("users_csv", args.users)
+    # Reading is cheap next to caching three DataFrames, so load isn't cached
+    pipe.add_stage("load", load, ["ratings_csv", "books_csv", "users_csv"], cache=False)
+    pipe.add_stage("clean", clean, ["load"])
+    pipe.add_stage("encode", encode, ["clean"])
+    pipe.add_stage("csr", ratings_to_csr, ["encode"])
+    pipe.add_stage("cf", fit_cf, ["csr", "encode"], cf_components=args.components, cf_engine=args.cf_engine)
+    pipe.add_stage("content", content, ["clean"])
+    # Worker count doesn't change the table, so it's bound outside the cache key
+    pipe.add_stage("neighbours", partial(neighbours, n_jobs=args.jobs), ["content"], top_n=args.neighbours)
+    pipe.add_stage("popularity", popularity, ["clean"])
+    pipe.add_stage("segments", segments, ["clean", "popularity"])
+    pipe.add_stage("assemble", assemble, ["cf", "content", "neighbours", "popularity", "segments"], cache=False)
+    # Keyed on the CF fit alone: content/neighbour/popularity changes don't rebuild it
+    pipe.add_stage("ann", ann_index, ["cf", "encode"], n_lists=args.ann_lists, n_probe=args.ann_probe)
+    return pipe
 
-# Ensure models dir exists
-os.makedirs(MODEL_DIR, exist_ok=True)
 
-print("📖 Loading dataset...")
-books_df = pd.read_csv(DATA_PATH)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the hybrid recommender")
+    parser.add_argument("--ratings", default="data/Ratings.csv")
+    parser.add_argument("--books", default="data/Books.csv")
+    parser.add_argument("--users", default="data/Users.csv")
+    parser.add_argument("--models", default="models", help="model root; versions are published here")
+    parser.add_argument("--version", default=None)
+    parser.add_argument("--cache-dir", default=".cache/train")
+    parser.add_argument("--force", action="store_true", help="recompute every stage")
+    parser.add_argument("--components", type=int, default=50)
+    parser.add_argument("--cf-engine", default="svd", choices=["svd", "als"])
+    parser.add_argument("--neighbours", type=int, default=50)
+    parser.add_argument("--ann-lists", type=int, default=256)
+    parser.add_argument("--ann-probe", type=int, default=8)
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
 
-# Dummy collaborative filtering (replace with ML later)
-print("⚙️ Training dummy CF model...")
-cf_matrix = np.random.rand(len(books_df), 100)
+    pipe = build_pipeline(args)
+    rec = pipe.get("assemble")
+    index = pipe.get("ann")
 
-print("💾 Saving model...")
-with open(MODEL_PATH, "wb") as f:
-    pickle.dump(cf_matrix, f)
+    # Written to a scratch dir, then published as a new version (model_store.py)
+    build_dir = os.path.join(args.models, "build")
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+    rec.cf_index = index
+    rec.save(os.path.join(build_dir, "recommender"))
+    with open(os.path.join(build_dir, "train_report.json"), "w") as f:
+        json.dump({"stages": pipe.report, "keys": {name: pipe.key(name) for name in pipe.stages}}, f, indent=2)
+    version = model_store.publish(build_dir, root=args.models, version=args.version)
+    shutil.rmtree(build_dir, ignore_errors=True)
 
-print(f"✅ Model saved at {MODEL_PATH}")
+    total = sum(stage["seconds"] for stage in pipe.report)
+    print(f"✅ Model version {version} published to {args.models} ({total:.2f}s in stages)")